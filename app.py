@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 import os
+import sys
+import io
 import pwd
 import pam
 import libtmux
@@ -8,8 +10,40 @@ import subprocess
 import signal
 import secrets
 import json
+import re
+import cProfile
+import pstats
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import time
+import bisect
+import codecs
+import gzip
+import hashlib
+import shutil
+import mimetypes
+from collections import deque
+from contextlib import contextmanager
+import eventlet
+import eventlet.semaphore
+from eventlet import tpool
+from eventlet.event import Event
+from eventlet.queue import LightQueue
+from eventlet.green import subprocess as green_subprocess
+from eventlet.green import socket as green_socket
+from eventlet.hubs import trampoline
 from pathlib import Path
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, send_from_directory, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Opzionale: senza il modulo si generano solo le varianti gzip
+try:
+    import msgpack
+except ImportError:
+    msgpack = None  # Opzionale: senza il modulo la codifica compatta viaggia in JSON
 from flask_socketio import SocketIO, emit
 
 app = Flask(__name__)
@@ -37,6 +71,145 @@ else:
 ttyd_instances = {}
 terminal_counter = 0
 
+# Spawn di ttyd in corso: {(username, host_id, session_name): Event}
+# Le richieste concorrenti per la stessa sessione attendono lo stesso risultato
+ttyd_spawns_inflight = {}
+
+# Contatori operativi esposti da /api/metrics
+metrics = {
+    'ttyd_spawns': 0,
+    'ttyd_spawns_coalesced': 0,
+    'ttyd_reused': 0,
+    'tmux_control_commands': 0,
+    'tmux_forked_commands': 0,
+    'pam_calls': 0,
+    'pam_rejected_busy': 0,
+    'login_throttled': 0,
+    'admission_shed_load': 0,
+    'admission_rejected_queue_full': 0,
+    'admission_rejected_timeout': 0,
+    'admission_rejected_global_cap': 0,
+    'admission_rejected_user_cap': 0,
+    'recording_chunks_written': 0,
+    'search_panes_indexed': 0,
+    'preview_captures': 0,
+    'preview_cache_hits': 0,
+    'ttyd_ready_timeouts': 0,
+    'ttyd_ready_ms_total': 0,
+    'ttyd_hibernated': 0,
+    'ttyd_released_idle': 0,
+}
+
+# Autenticazione PAM: verifiche parallele massime e richieste in coda
+PAM_WORKERS = int(os.environ.get('PAM_WORKERS', '4'))
+PAM_QUEUE_LIMIT = int(os.environ.get('PAM_QUEUE_LIMIT', '16'))
+pam_executor = ThreadPoolExecutor(PAM_WORKERS, thread_name_prefix='pam')  # separato da tpool
+pam_waiting = 0
+
+# Throttling dei login falliti: {('user'|'ip', value): {'failures', 'blocked_until', 'last_failure'}}
+LOGIN_FREE_ATTEMPTS = 3         # tentativi falliti senza attesa
+LOGIN_BACKOFF_BASE = 2          # secondi, raddoppia ad ogni fallimento successivo
+LOGIN_BACKOFF_MAX = 300
+LOGIN_THROTTLE_RESET = 900      # dopo 15 minuti senza errori si riparte da zero
+LOGIN_THROTTLE_MAX_ENTRIES = 10000
+login_failures = {}
+
+# Controllo di ammissione per i terminali (ttyd + ssh/tmux attach)
+MAX_TERMINALS = int(os.environ.get('MAX_TERMINALS', '200'))
+MAX_TERMINALS_PER_USER = int(os.environ.get('MAX_TERMINALS_PER_USER', '30'))
+MAX_CONCURRENT_SPAWNS = int(os.environ.get('MAX_CONCURRENT_SPAWNS', '8'))
+MAX_CONCURRENT_SPAWNS_PER_USER = int(os.environ.get('MAX_CONCURRENT_SPAWNS_PER_USER', '2'))
+SPAWN_QUEUE_LIMIT = int(os.environ.get('SPAWN_QUEUE_LIMIT', '32'))
+SPAWN_QUEUE_TIMEOUT = float(os.environ.get('SPAWN_QUEUE_TIMEOUT', '10'))
+SHED_MIN_MEM_AVAILABLE_MB = int(os.environ.get('SHED_MIN_MEM_AVAILABLE_MB', '256'))
+SHED_MAX_LOAD_PER_CPU = float(os.environ.get('SHED_MAX_LOAD_PER_CPU', '4.0'))
+HOST_PRESSURE_CACHE_TTL = 1
+spawn_slots = eventlet.semaphore.Semaphore(MAX_CONCURRENT_SPAWNS)
+user_spawn_slots = {}
+spawn_queue_waiting = 0
+# Spawn ammessi ma non ancora registrati in ttyd_instances (contano nei limiti)
+spawns_admitted = {'total': 0, 'users': {}}
+host_pressure_cache = {'checked_at': 0, 'message': None}
+
+# Uso di risorse per terminale (albero di processi di ogni ttyd letto da /proc)
+RESOURCE_SAMPLE_TTL = int(os.environ.get('RESOURCE_SAMPLE_TTL', '5'))
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+resource_snapshot = {'collected_at': 0, 'timestamp': None, 'terminals': {}, 'users': {}, 'hosts': {}, 'totals': {}}
+
+# Registrazioni delle sessioni (pipe-pane -> chunk compressi + indice)
+RECORDINGS_DIR = '/app/data/recordings'
+RECORDINGS_FIFO_DIR = '/tmp/workbench-recordings'
+RECORDING_CHUNK_SIZE = int(os.environ.get('RECORDING_CHUNK_SIZE', str(64 * 1024)))
+RECORDING_FLUSH_INTERVAL = 5  # secondi senza output prima di chiudere il chunk corrente
+active_recordings = {}  # {recording_id: SessionRecorder}
+
+# Ricerca nello scrollback: indici per utente aggiornati in background
+SEARCH_INDEX_INTERVAL = int(os.environ.get('SEARCH_INDEX_INTERVAL', '60'))
+SEARCH_HISTORY_LINES = int(os.environ.get('SEARCH_HISTORY_LINES', '2000'))
+SEARCH_TOKEN_RE = re.compile(r'\w+')
+PANE_LIST_FORMAT = '#{pane_id}|#{history_size}|#{window_activity}|#{session_name}|#{window_name}|#{window_index}|#{pane_index}'
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', str(4 * 3600)))  # scarta gli indici senza login/ricerche
+search_indexes = {}  # {username: ScrollbackIndex}
+
+# Anteprime delle sessioni (capture-pane del testo visibile)
+PREVIEW_CACHE_TTL = float(os.environ.get('PREVIEW_CACHE_TTL', '2'))
+PREVIEW_MIN_INTERVAL = float(os.environ.get('PREVIEW_MIN_INTERVAL', '1'))
+PREVIEW_VERSIONS_KEPT = 4
+PREVIEW_CACHE_EXPIRE = 300  # secondi senza richieste prima di scartare le anteprime di un host
+preview_cache = {}  # {(username, host_id): {'sessions': {name: {'version', 'versions'}}, 'fetched_at', 'used_at'}}
+preview_cache_pruned_at = 0
+preview_fetches_inflight = {}
+
+# Codifica compatta del listing e degli eventi Socket.IO, negoziata per client
+SESSION_ROW_FIELDS = ('id', 'name', 'created', 'windows', 'attached')
+socket_encodings = {}  # {sid: {'encoding': 'json'|'compact'|'msgpack', 'hosts': {host_id: [indice, nome, colore]}}}
+
+# Amministratori (profiling e diagnostica)
+ADMIN_USERS = {u.strip() for u in os.environ.get('ADMIN_USERS', 'root').split(',') if u.strip()}
+
+# Profiling su richiesta: handler attualmente profilati e risultati conclusi
+PROFILABLE_HANDLERS = set()
+SAMPLING_PROFILE_NAME = 'sampling'
+PROFILING_MAX_DURATION = 600
+profiled_handlers = {}  # {name: {'mode', 'started_at', 'until', 'calls', 'skipped', 'stats'}}
+profile_results = {}    # {name: profilo concluso (o campionamento in corso)}
+profile_active = False  # una sola chiamata profilata alla volta (c'e' un solo profiler per thread)
+
+# Contesti utente in cache: {username: UserContext}
+USER_CONTEXT_TTL = int(os.environ.get('USER_CONTEXT_TTL', '300'))
+user_contexts = {}
+
+# Client tmux persistenti in control mode per gli utenti locali: {uid: TmuxControlClient}
+tmux_control_clients = {}
+tmux_control_retry_at = {}
+TMUX_CONTROL_RETRY_INTERVAL = 2
+TMUX_QUOTE_PROBE = 'ready $HOME "a b" it\'s \\ \\\''  # eco di verifica della quotatura in control mode
+
+# Attesa attiva che ttyd (e in remote mode la route nginx) accetti connessioni
+TTYD_READY_TIMEOUT = float(os.environ.get('TTYD_READY_TIMEOUT', '5'))
+
+# Ibernazione: dopo HIBERNATE_AFTER secondi senza essere mostrato un tab chiude
+# il suo iframe e il server rilascia ttyd (0 = disattivata)
+HIBERNATE_AFTER = int(os.environ.get('HIBERNATE_AFTER', '900'))
+HIBERNATE_CHECK_INTERVAL = 60
+READY_PROBE_INITIAL_DELAY = 0.01
+READY_PROBE_MAX_DELAY = 0.2
+
+# Numero massimo di host remoti interrogati in parallelo durante il listing
+REMOTE_FETCH_CONCURRENCY = int(os.environ.get('REMOTE_FETCH_CONCURRENCY', '16'))
+
+# Nomi dei gruppi di host: finiscono in HTML e negli onclick della sidebar
+HOST_GROUP_RE = re.compile(r'[\w.-]+')
+
+# Asset statici serviti con nome fingerprint e cache immutabile
+# In remote mode nginx li serve direttamente da ASSETS_DIR (vedi nginx.conf)
+ASSET_FILES = ['js/app.js', 'js/msgpack.js', 'css/style.css', 'logo.png']
+ASSETS_DIR = os.path.join(app.static_folder, 'dist')
+ASSETS_URL_PREFIX = '/assets/'
+COMPRESSIBLE_EXTENSIONS = ('.js', '.css', '.svg', '.json')
+asset_manifest = {}  # {'js/app.js': 'js/app.<hash>.js'}
+
 # Remote hosts configuration file (per-user)
 HOSTS_CONFIG_DIR = '/app/data/hosts'
 os.makedirs(HOSTS_CONFIG_DIR, exist_ok=True)
@@ -76,11 +249,65 @@ def save_user_hosts(username, hosts):
     try:
         with open(hosts_file, 'w') as f:
             json.dump(hosts, f, indent=2)
+        invalidate_user_context(username)
         return True
     except Exception as e:
         print(f"Error saving hosts for {username}: {e}")
         return False
 
+def write_file_atomic(path, data):
+    """Scrive un file tramite rename, cosi' nessuno legge un file a meta'"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp{os.getpid()}'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+def build_assets():
+    """
+    Genera le copie fingerprint (hash del contenuto nel nome) degli asset
+    statici con le varianti precompresse .gz/.br e popola asset_manifest.
+    I file gia' presenti con lo stesso hash non vengono riscritti.
+    """
+    import sys
+
+    for rel_path in ASSET_FILES:
+        src = os.path.join(app.static_folder, rel_path)
+        try:
+            with open(src, 'rb') as f:
+                data = f.read()
+
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            base, ext = os.path.splitext(rel_path)
+            hashed_path = f'{base}.{digest}{ext}'
+            dest = os.path.join(ASSETS_DIR, hashed_path)
+
+            if not os.path.exists(dest):
+                write_file_atomic(dest, data)
+                if ext in COMPRESSIBLE_EXTENSIONS:
+                    write_file_atomic(f'{dest}.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                    if brotli is not None:
+                        write_file_atomic(f'{dest}.br', brotli.compress(data))
+
+            asset_manifest[rel_path] = hashed_path
+        except OSError as e:
+            sys.stderr.write(f"[ASSETS] Cannot build {rel_path}: {e}\n")
+            sys.stderr.flush()
+
+    sys.stderr.write(f"[ASSETS] {len(asset_manifest)} fingerprinted assets in {ASSETS_DIR}\n")
+    sys.stderr.flush()
+
+def asset_url(filename):
+    """URL di un asset statico: versione fingerprint se disponibile"""
+    hashed_path = asset_manifest.get(filename)
+    if hashed_path is None:
+        return url_for('static', filename=filename)
+    return ASSETS_URL_PREFIX + hashed_path
+
+@app.context_processor
+def inject_asset_url():
+    return {'asset_url': asset_url}
+
 def get_host_color(host_id):
     """Get a consistent color for a host based on its ID"""
     if host_id == 'local':
@@ -89,25 +316,144 @@ def get_host_color(host_id):
     hash_val = hash(host_id) % (len(HOST_COLORS) - 1)
     return HOST_COLORS[hash_val + 1]  # Skip first color (reserved for local)
 
+class UserContext:
+    """
+    Dati di un utente risolti una sola volta e condivisi da tutti gli handler:
+    uid/gid/home da NSS, socket tmux, ambiente per ssh e mappa degli host.
+    """
+
+    def __init__(self, username, uid, gid, home):
+        self.username = username
+        self.uid = uid
+        self.gid = gid
+        self.home = home
+        self.socket_path = f'{TMUX_SOCKET_BASE}{uid}/default'
+        self.ssh_env = {
+            'HOME': home,
+            'USER': username,
+            'LOGNAME': username,
+            'PATH': os.environ.get('PATH', '/usr/local/bin:/usr/bin:/bin'),
+        }
+        self.hosts = load_user_hosts(username)
+        self.hosts_by_id = {h['id']: h for h in self.hosts}
+        self.expires_at = time.monotonic() + USER_CONTEXT_TTL
+
+    @property
+    def enabled_hosts(self):
+        """Solo gli host remoti abilitati"""
+        return [h for h in self.hosts if h.get('enabled', True)]
+
+    def get_host(self, host_id):
+        """Configurazione di un host remoto, o None se non esiste"""
+        return self.hosts_by_id.get(host_id)
+
+def get_user_context(username):
+    """Restituisce il contesto dell'utente dalla cache, ricaricandolo a scadenza TTL"""
+    ctx = user_contexts.get(username)
+    if ctx is not None and ctx.expires_at > time.monotonic():
+        return ctx
+
+    user_info = pwd.getpwnam(username)
+    ctx = UserContext(username, user_info.pw_uid, user_info.pw_gid, user_info.pw_dir)
+    user_contexts[username] = ctx
+    return ctx
+
+def invalidate_user_context(username):
+    """Scarta il contesto in cache (es. dopo una modifica agli host)"""
+    user_contexts.pop(username, None)
+
+class AuthBusyError(Exception):
+    """Troppe autenticazioni PAM in corso o in coda"""
+    pass
+
+def _pam_authenticate(username, password):
+    """Chiamata PAM sincrona, eseguita in un thread di pam_executor"""
+    p = pam.pam()
+    return p.authenticate(username, password)
+
 def authenticate_user(username, password):
-    """Autentica l'utente usando PAM"""
+    """
+    Autentica l'utente usando PAM senza bloccare il loop eventlet: la chiamata
+    gira in un pool di PAM_WORKERS thread dedicato (non condiviso con tpool),
+    con al massimo PAM_QUEUE_LIMIT richieste in attesa. Oltre il limite
+    solleva AuthBusyError.
+    """
+    global pam_waiting
+
+    if pam_waiting >= PAM_WORKERS + PAM_QUEUE_LIMIT:
+        metrics['pam_rejected_busy'] += 1
+        raise AuthBusyError('Too many concurrent login attempts')
+
+    pam_waiting += 1
     try:
-        p = pam.pam()
-        return p.authenticate(username, password)
+        metrics['pam_calls'] += 1
+        future = pam_executor.submit(_pam_authenticate, username, password)
+        # Il risultato arriva da un thread OS: lo si attende cedendo il loop
+        while not future.done():
+            eventlet.sleep(0.02)
+        return future.result()
     except Exception as e:
         print(f"Authentication error: {e}")
         return False
+    finally:
+        pam_waiting -= 1
 
-def get_tmux_sessions(username=None):
-    """Ottiene tutte le sessioni tmux attive"""
+def get_client_ip():
+    """
+    IP del client. In remote mode arriva da nginx in X-Real-IP, che nginx
+    ricava da X-Forwarded-For del reverse proxy fidato (set_real_ip_from)
+    """
+    if USE_NGINX_PROXY:
+        return request.headers.get('X-Real-IP', request.remote_addr)
+    return request.remote_addr
+
+def get_login_retry_after(username, ip):
+    """Secondi di attesa prima di poter ritentare il login (0 se consentito)"""
+    now = time.monotonic()
+    retry_after = 0
+    for key in (('user', username), ('ip', ip)):
+        entry = login_failures.get(key)
+        if entry and entry['blocked_until'] > now:
+            retry_after = max(retry_after, entry['blocked_until'] - now)
+    return retry_after
+
+def record_login_failure(username, ip):
+    """Registra un tentativo fallito con backoff esponenziale per utente e IP"""
+    now = time.monotonic()
+
+    # Evita che la tabella cresca senza limiti durante un attacco distribuito
+    if len(login_failures) > LOGIN_THROTTLE_MAX_ENTRIES:
+        for key in [k for k, v in login_failures.items() if now - v['last_failure'] > LOGIN_THROTTLE_RESET]:
+            del login_failures[key]
+
+    for key in (('user', username), ('ip', ip)):
+        entry = login_failures.get(key)
+        if entry is None or now - entry['last_failure'] > LOGIN_THROTTLE_RESET:
+            entry = {'failures': 0, 'blocked_until': 0, 'last_failure': now}
+            login_failures[key] = entry
+
+        entry['failures'] += 1
+        entry['last_failure'] = now
+        excess = entry['failures'] - LOGIN_FREE_ATTEMPTS
+        if excess >= 0:
+            delay = min(LOGIN_BACKOFF_BASE * (2 ** excess), LOGIN_BACKOFF_MAX)
+            entry['blocked_until'] = now + delay
+
+def clear_login_failures(username, ip):
+    """Azzera i contatori dopo un login riuscito"""
+    login_failures.pop(('user', username), None)
+    login_failures.pop(('ip', ip), None)
+
+def get_tmux_sessions(ctx=None):
+    """Ottiene tutte le sessioni tmux attive (dell'utente del contesto, se indicato)"""
     sessions_list = []
 
     try:
-        if username:
+        if ctx:
             try:
-                user_info = pwd.getpwnam(username)
-                uid = user_info.pw_uid
-                socket_path = f'{TMUX_SOCKET_BASE}{uid}/default'
+                username = ctx.username
+                uid = ctx.uid
+                socket_path = ctx.socket_path
 
                 import sys
                 sys.stdout.flush()
@@ -117,23 +463,42 @@ def get_tmux_sessions(username=None):
                 sys.stderr.flush()
 
                 if os.path.exists(socket_path):
-                    server = libtmux.Server(socket_path=socket_path)
-                    print(f"[DEBUG] Server created, sessions: {len(server.sessions)}")
-
-                    for tmux_session in server.sessions:
+                    ok, lines, error = run_local_tmux(
+                        ctx, 'list-sessions', '-F',
+                        '#{session_id}|#{session_name}|#{session_created}|#{session_windows}|#{session_attached}'
+                    )
+                    if not ok:
+                        raise RuntimeError(error.strip())
+
+                    # I client control mode del server non contano come "attached"
+                    control_clients = {}
+                    ok, client_lines, _ = run_local_tmux(ctx, 'list-clients', '-F', '#{client_control_mode}|#{session_id}')
+                    if ok:
+                        for client_line in client_lines:
+                            control_mode, _, session_id = client_line.partition('|')
+                            if control_mode == '1':
+                                control_clients[session_id] = control_clients.get(session_id, 0) + 1
+
+                    print(f"[DEBUG] Sessions found: {len(lines)}")
+
+                    for line in lines:
+                        parts = line.split('|')
+                        if len(parts) < 5:
+                            continue
+                        attached = int(parts[4] or 0) - control_clients.get(parts[0], 0)
                         session_info = {
-                            'id': tmux_session.id,
-                            'name': tmux_session.name,
-                            'created': tmux_session.get('session_created'),
-                            'windows': len(tmux_session.windows),
-                            'attached': tmux_session.get('session_attached') != '0',
+                            'id': parts[0],
+                            'name': parts[1],
+                            'created': parts[2],
+                            'windows': int(parts[3]),
+                            'attached': attached > 0,
                             'host_id': 'local',
                             'host_name': 'Local',
                             'host_color': get_host_color('local')
                         }
                         sessions_list.append(session_info)
             except Exception as e:
-                print(f"Error getting sessions for user {username}: {e}")
+                print(f"Error getting sessions for user {ctx.username}: {e}")
         else:
             import glob
             for tmux_dir in glob.glob(f'{TMUX_SOCKET_BASE}*'):
@@ -161,7 +526,7 @@ def get_tmux_sessions(username=None):
         print(f"Error getting tmux sessions: {e}")
         return []
 
-def get_remote_tmux_sessions(host_config, username):
+def get_remote_tmux_sessions(host_config, ctx):
     """Get tmux sessions from a remote host via SSH"""
     sessions_list = []
 
@@ -169,7 +534,7 @@ def get_remote_tmux_sessions(host_config, username):
         host_id = host_config['id']
         hostname = host_config['hostname']
         ssh_port = host_config.get('port', 22)
-        ssh_user = host_config.get('username') or username  # Use same username if not specified
+        ssh_user = host_config.get('username') or ctx.username  # Use same username if not specified
 
         # Build SSH command to list tmux sessions
         ssh_cmd = [
@@ -185,22 +550,19 @@ def get_remote_tmux_sessions(host_config, username):
         ]
 
         import sys
-        import pwd
         sys.stderr.write(f"[SSH] Connecting to {hostname}:{ssh_port} as {ssh_user}\n")
         sys.stderr.flush()
 
-        # Get user info to run SSH as the logged-in user
-        user_info = pwd.getpwnam(username)
-        uid = user_info.pw_uid
-        gid = user_info.pw_gid
-
-        # Execute SSH command as the user (to use their SSH keys)
-        result = subprocess.run(
+        # Execute SSH command as the user (to use their SSH keys);
+        # subprocess green: attende senza bloccare il loop e senza thread
+        result = green_subprocess.run(
             ssh_cmd,
             capture_output=True,
             text=True,
             timeout=5,
-            preexec_fn=demote(uid, gid)
+            env=ctx.ssh_env,
+            user=ctx.uid,
+            group=ctx.gid
         )
 
         if result.returncode == 0:
@@ -236,20 +598,117 @@ def get_remote_tmux_sessions(host_config, username):
 
     return sessions_list
 
-def get_all_sessions(username):
-    """Get all tmux sessions (local + all configured remote hosts)"""
+def iter_remote_sessions(hosts, ctx):
+    """
+    Interroga gli host remoti in parallelo e restituisce (host_config, sessions)
+    nell'ordine in cui arrivano le risposte, non in quello della configurazione.
+    Ogni host ha il suo green thread e ssh gira con subprocess green, cosi' il
+    loop principale (e i websocket dei terminali) restano reattivi.
+    """
+    results = LightQueue()
+
+    def fetch(host):
+        try:
+            remote_sessions = get_remote_tmux_sessions(host, ctx)
+        except Exception as e:
+            import sys
+            sys.stderr.write(f"[SSH] Fetch failed for {host.get('hostname', 'unknown')}: {e}\n")
+            sys.stderr.flush()
+            remote_sessions = []
+        results.put((host, remote_sessions))
+
+    pool = eventlet.GreenPool(REMOTE_FETCH_CONCURRENCY)
+    for host in hosts:
+        pool.spawn_n(fetch, host)
+
+    for _ in range(len(hosts)):
+        yield results.get()
+
+def normalize_host_groups(groups):
+    """
+    Accetta una lista o una stringa separata da virgole; restituisce gruppi unici.
+    I nomi finiscono in HTML e negli handler della sidebar: sono ammessi solo
+    lettere, cifre, '_', '.' e '-' (ValueError altrimenti)
+    """
+    if isinstance(groups, str):
+        groups = groups.split(',')
+    if not isinstance(groups, list):
+        return []
+    normalized = []
+    for group in groups:
+        group = str(group).strip()
+        if not group:
+            continue
+        if not HOST_GROUP_RE.fullmatch(group):
+            raise ValueError(f'Invalid group name "{group}": use letters, digits, "_", "." and "-"')
+        if group not in normalized:
+            normalized.append(group)
+    return normalized
+
+def host_group_names(host):
+    """Gruppi validi di un host (ignora nomi salvati prima della validazione)"""
+    return [g for g in host.get('groups') or [] if isinstance(g, str) and HOST_GROUP_RE.fullmatch(g)]
+
+def get_host_groups(hosts):
+    """Mappa {gruppo: [host_id]} degli host indicati"""
+    groups = {}
+    for host in hosts:
+        for group in host_group_names(host):
+            groups.setdefault(group, []).append(host['id'])
+    return groups
+
+def select_hosts(ctx, group=None, host_ids=None, lazy=False, expanded_groups=()):
+    """
+    Sceglie quali host interrogare per il listing, invece di tutti gli host abilitati:
+    - group: solo gli host di quel gruppo
+    - host_ids: solo gli host indicati ('local' incluso se presente)
+    - lazy: salta gli host che appartengono solo a gruppi non espansi
+    Returns: (hosts remoti da interrogare, include_local)
+    """
+    hosts = ctx.enabled_hosts
+    include_local = True
+
+    if group:
+        hosts = [h for h in hosts if group in host_group_names(h)]
+        include_local = False
+    if host_ids:
+        hosts = [h for h in hosts if h['id'] in host_ids]
+        include_local = 'local' in host_ids
+    if lazy and not group and not host_ids:
+        hosts = [h for h in hosts
+                 if not host_group_names(h) or any(g in expanded_groups for g in host_group_names(h))]
+
+    return hosts, include_local
+
+def parse_host_selection(params):
+    """Legge group/hosts/lazy/expanded da query string o payload Socket.IO"""
+    def as_list(value):
+        if isinstance(value, list):
+            return [str(v) for v in value if v]
+        return [v for v in (value or '').split(',') if v]
+
+    lazy = params.get('lazy')
+    return {
+        'group': params.get('group') or None,
+        'host_ids': as_list(params.get('hosts')) or None,
+        'lazy': lazy in (True, '1', 'true'),
+        'expanded_groups': as_list(params.get('expanded')),
+    }
+
+def get_all_sessions(ctx, hosts=None, include_local=True):
+    """Get all tmux sessions (local + configured remote hosts, all enabled ones by default)"""
     all_sessions = []
 
     # Get local sessions
-    local_sessions = get_tmux_sessions(username)
-    all_sessions.extend(local_sessions)
+    if include_local:
+        local_sessions = get_tmux_sessions(ctx)
+        all_sessions.extend(local_sessions)
 
-    # Get remote sessions from all configured hosts
-    hosts = load_user_hosts(username)
-    for host in hosts:
-        if host.get('enabled', True):  # Only query enabled hosts
-            remote_sessions = get_remote_tmux_sessions(host, username)
-            all_sessions.extend(remote_sessions)
+    # Get remote sessions from the selected hosts (in parallel)
+    if hosts is None:
+        hosts = ctx.enabled_hosts
+    for _, remote_sessions in iter_remote_sessions(hosts, ctx):
+        all_sessions.extend(remote_sessions)
 
     return all_sessions
 
@@ -262,12 +721,227 @@ def find_free_port():
         port = s.getsockname()[1]
     return port
 
-def demote(uid, gid):
-    """Crea una funzione che cambia l'utente del processo"""
-    def set_ids():
-        os.setgid(gid)
-        os.setuid(uid)
-    return set_ids
+class TmuxControlError(Exception):
+    """Errore di comunicazione con un client tmux in control mode"""
+    pass
+
+class TmuxControlClient:
+    """
+    Client tmux persistente in control mode (tmux -C) per un utente locale.
+    Il processo gira con uid/gid dell'utente; i comandi viaggiano su stdin e le
+    risposte (%begin ... %end / %error) sono abbinate in ordine FIFO alle
+    richieste, quindi ogni operazione e' un messaggio sulla pipe invece di un
+    fork+exec+setuid.
+    """
+
+    def __init__(self, socket_path, uid, gid):
+        self.socket_path = socket_path
+        self.uid = uid
+        self.gid = gid
+        self.process = None
+        self.pending = deque()
+        self.write_lock = eventlet.semaphore.Semaphore(1)
+        self.alive = False
+
+    def start(self):
+        """Avvia tmux -C agganciato al server dell'utente (serve almeno una sessione)"""
+        self.process = green_subprocess.Popen(
+            ['tmux', '-C', '-S', self.socket_path, 'attach-session', '-f', 'no-output,ignore-size'],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            user=self.uid,
+            group=self.gid
+        )
+        self.alive = True
+        eventlet.spawn_n(self._read_loop)
+
+        # Handshake: se il server non c'e' o non ha sessioni tmux esce subito.
+        # L'eco di $ " ' \\ verifica anche che la quotatura arrivi intatta,
+        # altrimenti si torna ai comandi con fork
+        ok, lines = self.command('display-message', '-p', TMUX_QUOTE_PROBE)
+        if not ok or lines != [TMUX_QUOTE_PROBE]:
+            raise TmuxControlError(f'argument quoting check failed: {lines!r}')
+
+    def _read_loop(self):
+        """Legge l'output di tmux e completa le richieste in attesa"""
+        block = None
+        try:
+            for raw in self.process.stdout:
+                line = raw.decode('utf-8', errors='replace').rstrip('\n')
+
+                if block is None:
+                    if line.startswith('%begin '):
+                        fields = line.split()
+                        # Il flag 1 indica un comando inviato da questo client
+                        ours = len(fields) < 4 or fields[3] == '1'
+                        block = {'ours': ours, 'lines': [], 'tag': fields[1:3]}
+                    elif line.startswith('%exit'):
+                        break
+                    # Le altre notifiche (%session-changed, ...) vengono ignorate
+                    continue
+
+                # Il terminatore riporta tempo e numero del %begin: una riga
+                # di output (es. capture-pane) che inizia con %end non chiude il blocco
+                if (line.startswith('%end ') or line.startswith('%error ')) and line.split()[1:3] == block['tag']:
+                    if block['ours'] and self.pending:
+                        event = self.pending.popleft()
+                        event.send((line.startswith('%end '), block['lines']))
+                    block = None
+                else:
+                    block['lines'].append(line)
+        except Exception as e:
+            import sys
+            sys.stderr.write(f"[TMUX-C] Read error on {self.socket_path}: {e}\n")
+            sys.stderr.flush()
+        finally:
+            self._shutdown()
+
+    def _shutdown(self):
+        """Marca il client come morto e sblocca chi attende una risposta"""
+        self.alive = False
+        while self.pending:
+            self.pending.popleft().send_exception(TmuxControlError('tmux control client exited'))
+        if self.process and self.process.poll() is None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+
+    def command(self, *args, timeout=5):
+        """
+        Invia un comando tmux e attende la risposta.
+        Returns: (success, output_lines)
+        """
+        if not self.alive:
+            raise TmuxControlError('tmux control client is not running')
+
+        line = ' '.join(tmux_quote(a) for a in args) + '\n'
+        event = Event()
+
+        with self.write_lock:
+            self.pending.append(event)
+            try:
+                self.process.stdin.write(line.encode('utf-8'))
+                self.process.stdin.flush()
+            except (OSError, ValueError) as e:
+                self._shutdown()
+                raise TmuxControlError(f'write failed: {e}')
+
+        try:
+            with eventlet.Timeout(timeout):
+                return event.wait()
+        except eventlet.Timeout:
+            # Le risposte successive non sarebbero piu' allineate: si ricomincia
+            self._shutdown()
+            raise TmuxControlError('timeout waiting for tmux reply')
+
+def tmux_quote(arg):
+    """Quota un argomento per la riga di comando di tmux"""
+    arg = str(arg)
+    if '\n' in arg or '\r' in arg:
+        raise ValueError('tmux arguments cannot contain newlines')
+    # Tra apici singoli tmux non interpreta escape ne' $; un apice si chiude,
+    # si inserisce come \' e si riapre (le parti adiacenti formano una parola)
+    return "'" + arg.replace("'", "'\\''") + "'"
+
+def get_tmux_control_client(ctx):
+    """Restituisce il client control mode dell'utente, (ri)connettendolo se serve"""
+    uid = ctx.uid
+    client = tmux_control_clients.get(uid)
+    if client is not None and client.alive:
+        return client
+
+    now = time.monotonic()
+    if tmux_control_retry_at.get(uid, 0) > now:
+        return None
+
+    socket_path = ctx.socket_path
+    if not os.path.exists(socket_path):
+        return None
+
+    client = TmuxControlClient(socket_path, uid, ctx.gid)
+    try:
+        client.start()
+    except (TmuxControlError, OSError) as e:
+        client._shutdown()
+        tmux_control_retry_at[uid] = now + TMUX_CONTROL_RETRY_INTERVAL
+        import sys
+        sys.stderr.write(f"[TMUX-C] Cannot connect to {socket_path}: {e}\n")
+        sys.stderr.flush()
+        return None
+
+    tmux_control_clients[uid] = client
+    tmux_control_retry_at.pop(uid, None)
+    return client
+
+def run_local_tmux(ctx, *args):
+    """
+    Esegue un comando tmux sul socket locale dell'utente, tramite il client
+    control mode persistente se disponibile, altrimenti con un processo dedicato
+    (es. server non ancora avviato).
+    Returns: (success, output_lines, error_message)
+    """
+    client = get_tmux_control_client(ctx)
+    if client is not None:
+        try:
+            success, lines = client.command(*args)
+            metrics['tmux_control_commands'] += 1
+            if success:
+                return True, lines, ''
+            return False, lines, '\n'.join(lines)
+        except TmuxControlError as e:
+            import sys
+            sys.stderr.write(f"[TMUX-C] {e}, falling back to fork\n")
+            sys.stderr.flush()
+
+    metrics['tmux_forked_commands'] += 1
+    result = subprocess.run(
+        ['tmux', '-S', ctx.socket_path] + list(args),
+        capture_output=True,
+        text=True,
+        user=ctx.uid,
+        group=ctx.gid
+    )
+    return result.returncode == 0, result.stdout.splitlines(), result.stderr
+
+def wait_until_ready(probe, timeout=TTYD_READY_TIMEOUT, process=None):
+    """
+    Ripete probe() con backoff esponenziale finche' restituisce True o scade il
+    timeout. Le attese sono eventlet.sleep, quindi gli altri green thread
+    continuano a girare. Se process termina nel frattempo si rinuncia subito.
+    Returns: True se pronto, False altrimenti
+    """
+    deadline = time.monotonic() + timeout
+    delay = READY_PROBE_INITIAL_DELAY
+    while True:
+        if process is not None and process.poll() is not None:
+            return False
+        if probe():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        eventlet.sleep(min(delay, remaining))
+        delay = min(delay * 2, READY_PROBE_MAX_DELAY)
+
+def probe_tcp_port(port):
+    """True se qualcosa accetta connessioni su 127.0.0.1:port"""
+    try:
+        with green_socket.create_connection(('127.0.0.1', port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+def probe_nginx_terminal_route(terminal_id):
+    """True quando nginx instrada /terminal/<id>/ verso ttyd (non piu' 404 da Flask)"""
+    try:
+        with green_socket.create_connection(('127.0.0.1', 80), timeout=0.5) as conn:
+            conn.sendall(f'HEAD /terminal/{terminal_id}/ HTTP/1.0\r\nHost: localhost\r\n\r\n'.encode('ascii'))
+            status_line = conn.recv(64).split(b'\r\n', 1)[0].split()
+            return len(status_line) >= 2 and status_line[1] != b'404'
+    except OSError:
+        return False
 
 def create_nginx_terminal_config(terminal_id, port):
     """Crea una configurazione nginx per un terminale specifico (solo remote mode)"""
@@ -295,6 +969,12 @@ location /terminal/{terminal_id} {{
     config_file = os.path.join(NGINX_TERMINALS_DIR, f'terminal_{terminal_id}.conf')
 
     try:
+        # Configurazione gia' presente e identica: niente reload
+        if os.path.exists(config_file):
+            with open(config_file) as f:
+                if f.read() == config_content:
+                    return True
+
         with open(config_file, 'w') as f:
             f.write(config_content)
 
@@ -306,9 +986,10 @@ location /terminal/{terminal_id} {{
         sys.stderr.write(f"[NGINX] Reloaded configuration\n")
         sys.stderr.flush()
 
-        # Small delay to ensure nginx has fully reloaded before responding to client
-        import time
-        time.sleep(0.3)
+        # Attendi che i worker nginx ricaricati servano la nuova location
+        if not wait_until_ready(lambda: probe_nginx_terminal_route(terminal_id)):
+            sys.stderr.write(f"[NGINX] Route /terminal/{terminal_id} not ready after {TTYD_READY_TIMEOUT}s\n")
+            sys.stderr.flush()
 
         return True
     except Exception as e:
@@ -335,13 +1016,12 @@ def remove_nginx_terminal_config(terminal_id):
             sys.stderr.flush()
 
             # Small delay to ensure nginx has fully reloaded
-            import time
-            time.sleep(0.3)
+            eventlet.sleep(0.3)
     except Exception as e:
         sys.stderr.write(f"[NGINX] Error removing config: {e}\n")
         sys.stderr.flush()
 
-def start_ttyd(session_name, username, host_id='local'):
+def start_ttyd(session_name, ctx, host_id='local'):
     """
     Avvia un'istanza di ttyd per una sessione tmux specifica (locale o remota via SSH)
     Returns: (terminal_id, port) or (None, None) on error
@@ -349,18 +1029,19 @@ def start_ttyd(session_name, username, host_id='local'):
     global terminal_counter
 
     try:
-        user_info = pwd.getpwnam(username)
-        uid = user_info.pw_uid
-        gid = user_info.pw_gid
+        username = ctx.username
+        uid = ctx.uid
+        gid = ctx.gid
 
         port = find_free_port()
         token = secrets.token_urlsafe(32)
+        spawned_at = time.monotonic()
 
         import sys
 
         if host_id == 'local':
             # Local tmux session
-            socket_path = f'{TMUX_SOCKET_BASE}{uid}/default'
+            socket_path = ctx.socket_path
 
             cmd = [
                 'ttyd',
@@ -379,19 +1060,15 @@ def start_ttyd(session_name, username, host_id='local'):
 
             process = subprocess.Popen(
                 cmd,
-                preexec_fn=demote(uid, gid),
+                user=uid,
+                group=gid,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
             )
 
         else:
             # Remote tmux session via SSH
-            hosts = load_user_hosts(username)
-            host_config = None
-            for h in hosts:
-                if h['id'] == host_id:
-                    host_config = h
-                    break
+            host_config = ctx.get_host(host_id)
 
             if not host_config:
                 sys.stderr.write(f"[TTYD] Host {host_id} not found\n")
@@ -427,14 +1104,26 @@ def start_ttyd(session_name, username, host_id='local'):
             sys.stderr.write(f"[TTYD] SSH command: {ssh_cmd}\n")
             sys.stderr.flush()
 
-            # Run ttyd with demote so SSH uses user's keys
+            # Run ttyd as the user so SSH uses user's keys
             process = subprocess.Popen(
                 cmd,
-                preexec_fn=demote(uid, gid),
+                env=ctx.ssh_env,
+                user=uid,
+                group=gid,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE
             )
 
+        # Attendi che ttyd sia in ascolto prima di annunciare il terminale
+        if not wait_until_ready(lambda: probe_tcp_port(port), process=process):
+            metrics['ttyd_ready_timeouts'] += 1
+            sys.stderr.write(f"[TTYD] Not ready on port {port} after {TTYD_READY_TIMEOUT}s (exit code {process.poll()})\n")
+            sys.stderr.flush()
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            return None, None
+
         terminal_id = str(terminal_counter)
         terminal_counter += 1
 
@@ -445,14 +1134,20 @@ def start_ttyd(session_name, username, host_id='local'):
             'session_name': session_name,
             'username': username,
             'token': token,
-            'host_id': host_id
+            'host_id': host_id,
+            'holders': set(),               # sid dei client che mostrano questo terminale
+            'idle_since': time.monotonic()  # da quando non ha client (None se ne ha)
         }
 
         # Create nginx config if in remote mode
         if USE_NGINX_PROXY:
             create_nginx_terminal_config(terminal_id, port)
 
-        sys.stderr.write(f"[TTYD] Started with PID {process.pid}, terminal_id={terminal_id}, port={port}\n")
+        ready_ms = round((time.monotonic() - spawned_at) * 1000, 1)
+        ttyd_instances[terminal_id]['ready_ms'] = ready_ms
+        metrics['ttyd_ready_ms_total'] += ready_ms
+
+        sys.stderr.write(f"[TTYD] Started with PID {process.pid}, terminal_id={terminal_id}, port={port}, ready in {ready_ms}ms\n")
         sys.stderr.flush()
 
         return terminal_id, port
@@ -465,18 +1160,21 @@ def start_ttyd(session_name, username, host_id='local'):
 
 def stop_ttyd(terminal_id):
     """Termina un'istanza di ttyd"""
-    if terminal_id in ttyd_instances:
-        instance = ttyd_instances[terminal_id]
+    # Rimossa subito dalla mappa: durante l'attesa non deve essere riusata
+    instance = ttyd_instances.pop(terminal_id, None)
+    if instance is not None:
         process = instance['process']
 
         import sys
         sys.stderr.write(f"[TTYD] Stopping terminal_id={terminal_id}, PID={process.pid}\n")
         sys.stderr.flush()
 
-        try:
-            process.terminate()
-            process.wait(timeout=5)
-        except subprocess.TimeoutExpired:
+        # Attesa cooperativa: non blocca il loop eventlet
+        process.terminate()
+        deadline = time.monotonic() + 5
+        while process.poll() is None and time.monotonic() < deadline:
+            eventlet.sleep(0.05)
+        if process.poll() is None:
             process.kill()
             process.wait()
 
@@ -484,11 +1182,1137 @@ def stop_ttyd(terminal_id):
         if USE_NGINX_PROXY:
             remove_nginx_terminal_config(terminal_id)
 
-        del ttyd_instances[terminal_id]
-
         sys.stderr.write(f"[TTYD] Stopped terminal_id={terminal_id}\n")
         sys.stderr.flush()
 
+def hold_terminal(terminal_id, sid):
+    """Registra un client che sta usando il terminale"""
+    instance = ttyd_instances.get(terminal_id)
+    if instance is not None:
+        instance['holders'].add(sid)
+        instance['idle_since'] = None
+
+def release_terminal(terminal_id, sid):
+    """
+    Il client non usa piu' il terminale. Returns: True se non ne resta nessuno
+    (il terminale e' da quel momento inattivo)
+    """
+    instance = ttyd_instances.get(terminal_id)
+    if instance is None:
+        return False
+    instance['holders'].discard(sid)
+    if instance['holders']:
+        return False
+    if instance['idle_since'] is None:
+        instance['idle_since'] = time.monotonic()
+    return True
+
+def hibernation_reaper_loop():
+    """
+    Green thread che rilascia i ttyd senza client da piu' di HIBERNATE_AFTER
+    secondi (es. browser chiusi senza ibernare i tab) e quelli gia' terminati
+    """
+    while True:
+        eventlet.sleep(HIBERNATE_CHECK_INTERVAL)
+        now = time.monotonic()
+        for terminal_id, instance in list(ttyd_instances.items()):
+            if instance['process'].poll() is not None:
+                stop_ttyd(terminal_id)
+            elif (instance['idle_since'] is not None and
+                  now - instance['idle_since'] > HIBERNATE_AFTER):
+                metrics['ttyd_released_idle'] += 1
+                stop_ttyd(terminal_id)
+
+class AdmissionError(Exception):
+    """Richiesta di terminale rifiutata dal controllo di ammissione"""
+    pass
+
+def read_mem_available_mb():
+    """Memoria disponibile in MB da /proc/meminfo (None se non leggibile)"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+def get_host_pressure():
+    """
+    Verifica memoria e carico del sistema rispetto alle soglie configurate.
+    Returns: messaggio di errore se il server e' sotto pressione, altrimenti None
+    (il risultato viene riusato per HOST_PRESSURE_CACHE_TTL secondi)
+    """
+    now = time.monotonic()
+    if host_pressure_cache['checked_at'] + HOST_PRESSURE_CACHE_TTL > now:
+        return host_pressure_cache['message']
+
+    message = None
+    mem_available = read_mem_available_mb()
+    if mem_available is not None and mem_available < SHED_MIN_MEM_AVAILABLE_MB:
+        message = f'Server low on memory ({mem_available} MB available), try again later'
+    else:
+        load_per_cpu = os.getloadavg()[0] / (os.cpu_count() or 1)
+        if load_per_cpu > SHED_MAX_LOAD_PER_CPU:
+            message = f'Server overloaded (load {load_per_cpu:.1f} per CPU), try again later'
+
+    host_pressure_cache['checked_at'] = now
+    host_pressure_cache['message'] = message
+    return message
+
+def count_live_terminals(username=None):
+    """Numero di ttyd ancora in esecuzione (di tutti o di un utente)"""
+    return sum(
+        1 for instance in ttyd_instances.values()
+        if instance['process'].poll() is None and (username is None or instance['username'] == username)
+    )
+
+def read_proc_table():
+    """
+    Legge /proc in un solo passaggio: {pid: (ppid, cpu_ticks, rss_pages)}.
+    I processi che terminano durante la lettura vengono ignorati.
+    """
+    table = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat', 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        # Il nome del comando (campo 2) puo' contenere spazi e parentesi
+        fields = data[data.rfind(b')') + 2:].split()
+        try:
+            table[int(entry)] = (int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21]))
+        except (IndexError, ValueError):
+            continue
+    return table
+
+def count_proc_fds(pid):
+    """Returns: (fd aperti, di cui socket) di un processo"""
+    fds = sockets = 0
+    try:
+        for fd in os.listdir(f'/proc/{pid}/fd'):
+            fds += 1
+            try:
+                if os.readlink(f'/proc/{pid}/fd/{fd}').startswith('socket:'):
+                    sockets += 1
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return fds, sockets
+
+def collect_terminal_resources(roots):
+    """
+    Aggrega CPU, RSS, fd e socket dell'albero di processi di ogni terminale.
+    roots: {terminal_id: pid di ttyd}
+    Returns: {terminal_id: {'pids', 'cpu_seconds', 'rss_bytes', 'fds', 'sockets'}}
+    """
+    table = read_proc_table()
+    children = {}
+    for pid, (ppid, _, _) in table.items():
+        children.setdefault(ppid, []).append(pid)
+
+    results = {}
+    for terminal_id, root in roots.items():
+        usage = {'pids': 0, 'cpu_seconds': 0.0, 'rss_bytes': 0, 'fds': 0, 'sockets': 0}
+        stack = [root] if root in table else []
+        while stack:
+            pid = stack.pop()
+            _, ticks, rss_pages = table[pid]
+            fds, sockets = count_proc_fds(pid)
+            usage['pids'] += 1
+            usage['cpu_seconds'] += ticks / CLOCK_TICKS
+            usage['rss_bytes'] += rss_pages * PAGE_SIZE
+            usage['fds'] += fds
+            usage['sockets'] += sockets
+            stack.extend(children.get(pid, ()))
+        results[terminal_id] = usage
+    return results
+
+def empty_resource_usage():
+    return {'terminals': 0, 'pids': 0, 'cpu_seconds': 0.0, 'rss_bytes': 0, 'fds': 0, 'sockets': 0}
+
+def get_terminal_resources():
+    """
+    Snapshot dell'uso di risorse per terminale, utente e host (riusato per
+    RESOURCE_SAMPLE_TTL secondi). cpu_percent e' calcolato rispetto allo snapshot
+    precedente dello stesso terminale.
+    """
+    now = time.monotonic()
+    if resource_snapshot['collected_at'] + RESOURCE_SAMPLE_TTL > now:
+        return resource_snapshot
+
+    instances = {
+        tid: instance for tid, instance in list(ttyd_instances.items())
+        if instance['process'].poll() is None
+    }
+    roots = {tid: instance['process'].pid for tid, instance in instances.items()}
+    usage = tpool.execute(collect_terminal_resources, roots)
+
+    previous = resource_snapshot['terminals']
+    elapsed = now - resource_snapshot['collected_at']
+    terminals = {}
+    users = {}
+    hosts = {}
+    totals = empty_resource_usage()
+
+    for tid, instance in instances.items():
+        entry = dict(usage[tid])
+        entry['cpu_seconds'] = round(entry['cpu_seconds'], 2)
+        prev = previous.get(tid)
+        if prev and elapsed > 0:
+            entry['cpu_percent'] = round(max(0.0, entry['cpu_seconds'] - prev['cpu_seconds']) * 100 / elapsed, 1)
+        else:
+            entry['cpu_percent'] = None
+        entry.update({
+            'username': instance['username'],
+            'host_id': instance.get('host_id', 'local'),
+            'session_name': instance['session_name'],
+            'root_pid': roots[tid]
+        })
+        terminals[tid] = entry
+
+        for bucket in (totals, users.setdefault(entry['username'], empty_resource_usage()),
+                       hosts.setdefault(entry['host_id'], empty_resource_usage())):
+            bucket['terminals'] += 1
+            for field in ('pids', 'cpu_seconds', 'rss_bytes', 'fds', 'sockets'):
+                bucket[field] += entry[field]
+
+    for bucket in [totals, *users.values(), *hosts.values()]:
+        bucket['cpu_seconds'] = round(bucket['cpu_seconds'], 2)
+
+    resource_snapshot.update({
+        'collected_at': now,
+        'timestamp': time.time(),
+        'terminals': terminals,
+        'users': users,
+        'hosts': hosts,
+        'totals': totals
+    })
+    return resource_snapshot
+
+@contextmanager
+def terminal_spawn_slot(username):
+    """
+    Controllo di ammissione per un nuovo ttyd: scarta il carico se il server e'
+    sotto pressione, mette in coda (limitata) le richieste oltre il numero di
+    spawn concorrenti e applica i limiti globali e per-utente sui terminali.
+    Solleva AdmissionError con un messaggio da mostrare all'utente.
+    """
+    global spawn_queue_waiting
+
+    pressure = get_host_pressure()
+    if pressure:
+        metrics['admission_shed_load'] += 1
+        raise AdmissionError(pressure)
+
+    if spawn_queue_waiting >= SPAWN_QUEUE_LIMIT:
+        metrics['admission_rejected_queue_full'] += 1
+        raise AdmissionError('Too many terminals are starting, try again later')
+
+    user_slots = user_spawn_slots.get(username)
+    if user_slots is None:
+        user_slots = user_spawn_slots[username] = eventlet.semaphore.Semaphore(MAX_CONCURRENT_SPAWNS_PER_USER)
+
+    spawn_queue_waiting += 1
+    try:
+        if not user_slots.acquire(timeout=SPAWN_QUEUE_TIMEOUT):
+            metrics['admission_rejected_timeout'] += 1
+            raise AdmissionError('Timed out waiting to start terminal')
+        if not spawn_slots.acquire(timeout=SPAWN_QUEUE_TIMEOUT):
+            user_slots.release()
+            metrics['admission_rejected_timeout'] += 1
+            raise AdmissionError('Timed out waiting to start terminal')
+    finally:
+        spawn_queue_waiting -= 1
+
+    try:
+        # I limiti contano anche gli spawn concorrenti gia' ammessi
+        if count_live_terminals() + spawns_admitted['total'] >= MAX_TERMINALS:
+            metrics['admission_rejected_global_cap'] += 1
+            raise AdmissionError(f'Server terminal limit reached ({MAX_TERMINALS})')
+        if count_live_terminals(username) + spawns_admitted['users'].get(username, 0) >= MAX_TERMINALS_PER_USER:
+            metrics['admission_rejected_user_cap'] += 1
+            raise AdmissionError(f'You have reached the limit of {MAX_TERMINALS_PER_USER} open terminals, close some first')
+
+        spawns_admitted['total'] += 1
+        spawns_admitted['users'][username] = spawns_admitted['users'].get(username, 0) + 1
+        try:
+            yield
+        finally:
+            spawns_admitted['total'] -= 1
+            spawns_admitted['users'][username] -= 1
+            if not spawns_admitted['users'][username]:
+                del spawns_admitted['users'][username]
+    finally:
+        spawn_slots.release()
+        user_slots.release()
+
+class SessionRecorder:
+    """
+    Registrazione di un pane tmux locale tramite pipe-pane.
+    tmux scrive l'output del pane in una FIFO letta da un green thread; gli
+    eventi (stile asciicast v2: [secondi, "o", testo]) vengono raccolti in
+    chunk di dimensione fissa, compressi e scritti su disco, con un indice
+    append-only (index.jsonl) per cercare per tempo. La memoria usata resta
+    limitata a un chunk per registrazione.
+    """
+
+    def __init__(self, recording_id, ctx, session_name):
+        self.recording_id = recording_id
+        self.ctx = ctx
+        self.session_name = session_name
+        self.directory = os.path.join(RECORDINGS_DIR, ctx.username, recording_id)
+        self.fifo_path = os.path.join(RECORDINGS_FIFO_DIR, f'{recording_id}.fifo')
+        self.pane_id = None
+        self.started_at = None
+        self.started_monotonic = None
+        self.events = []
+        self.buffered_bytes = 0
+        self.chunk_seq = 0
+        self.chunk_start = None
+        self.read_fd = None
+        self.keepalive_fd = None
+        self.running = False
+        self.stopping = False
+
+    def start(self):
+        """Crea la FIFO, avvia pipe-pane e il green thread di lettura"""
+        ok, lines, error = run_local_tmux(
+            self.ctx, 'display-message', '-p', '-t', self.session_name,
+            '#{pane_id}|#{pane_width}|#{pane_height}'
+        )
+        if not ok or not lines:
+            raise RuntimeError(f'Session not found: {error.strip()}')
+        self.pane_id, width, height = lines[0].split('|')
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        os.makedirs(RECORDINGS_FIFO_DIR, mode=0o711, exist_ok=True)
+        os.mkfifo(self.fifo_path, 0o600)
+        os.chown(self.fifo_path, self.ctx.uid, self.ctx.gid)
+
+        # Lettore non bloccante + writer fittizio: la FIFO non va in EOF
+        # finche' tmux non apre il suo lato
+        self.read_fd = os.open(self.fifo_path, os.O_RDONLY | os.O_NONBLOCK)
+        self.keepalive_fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+
+        self.started_at = time.time()
+        self.started_monotonic = time.monotonic()
+
+        ok, _, error = run_local_tmux(self.ctx, 'pipe-pane', '-o', '-t', self.pane_id, f"cat > '{self.fifo_path}'")
+        if not ok:
+            # Nessuna registrazione vuota deve restare elencata
+            self.close_fds()
+            shutil.rmtree(self.directory, ignore_errors=True)
+            raise RuntimeError(f'pipe-pane failed: {error.strip()}')
+
+        # meta.json solo a pipe-pane riuscito: e' cio' che rende visibile la registrazione
+        self.write_meta(width=int(width), height=int(height))
+
+        self.running = True
+        eventlet.spawn_n(self._read_loop)
+
+    def write_meta(self, **extra):
+        """Aggiorna meta.json della registrazione"""
+        meta_path = os.path.join(self.directory, 'meta.json')
+        meta = {}
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        meta.update({
+            'id': self.recording_id,
+            'username': self.ctx.username,
+            'session_name': self.session_name,
+            'host_id': 'local',
+            'pane_id': self.pane_id,
+            'started_at': self.started_at,
+            'chunks': self.chunk_seq,
+        })
+        meta.update(extra)
+        write_file_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    def _read_loop(self):
+        """Legge l'output del pane e lo accumula in chunk"""
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        try:
+            while True:
+                try:
+                    trampoline(self.read_fd, read=True, timeout=RECORDING_FLUSH_INTERVAL)
+                except eventlet.Timeout:
+                    # Nessun output: svuota il buffer e controlla che il pane esista ancora
+                    self.flush_chunk()
+                    if self.stopping:
+                        break
+                    ok, _, _ = run_local_tmux(self.ctx, 'display-message', '-p', '-t', self.pane_id, '#{pane_id}')
+                    if not ok:
+                        break
+                    continue
+
+                try:
+                    data = os.read(self.read_fd, 65536)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    break
+
+                text = decoder.decode(data)
+                if text:
+                    self.events.append([round(time.monotonic() - self.started_monotonic, 6), 'o', text])
+                    self.buffered_bytes += len(data)
+                    if self.chunk_start is None:
+                        self.chunk_start = self.events[-1][0]
+                    if self.buffered_bytes >= RECORDING_CHUNK_SIZE:
+                        self.flush_chunk()
+        except Exception as e:
+            import sys
+            sys.stderr.write(f"[RECORD] Reader error on {self.recording_id}: {e}\n")
+            sys.stderr.flush()
+        finally:
+            self.finish()
+
+    def flush_chunk(self):
+        """Comprime gli eventi in buffer in un nuovo chunk e aggiorna l'indice"""
+        if not self.events:
+            return
+
+        self.chunk_seq += 1
+        chunk_file = f'{self.chunk_seq:06d}.jsonl.gz'
+        payload = ''.join(json.dumps(event) + '\n' for event in self.events).encode('utf-8')
+        write_file_atomic(os.path.join(self.directory, chunk_file), gzip.compress(payload, mtime=0))
+
+        entry = {
+            'seq': self.chunk_seq,
+            'file': chunk_file,
+            'start': self.chunk_start,
+            'end': self.events[-1][0],
+            'events': len(self.events),
+            'bytes': self.buffered_bytes,
+        }
+        with open(os.path.join(self.directory, 'index.jsonl'), 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+        metrics['recording_chunks_written'] += 1
+        self.events = []
+        self.buffered_bytes = 0
+        self.chunk_start = None
+
+    def close_fds(self):
+        for fd in (self.read_fd, self.keepalive_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self.read_fd = None
+        self.keepalive_fd = None
+        try:
+            os.unlink(self.fifo_path)
+        except OSError:
+            pass
+
+    def finish(self):
+        """Chiude la registrazione: ultimo chunk, meta e pulizia della FIFO"""
+        if not self.running:
+            return
+        self.running = False
+        self.flush_chunk()
+        self.write_meta(stopped_at=time.time(), duration=round(time.monotonic() - self.started_monotonic, 3))
+        self.close_fds()
+        active_recordings.pop(self.recording_id, None)
+
+        import sys
+        sys.stderr.write(f"[RECORD] Finished {self.recording_id} ({self.chunk_seq} chunks)\n")
+        sys.stderr.flush()
+
+    def stop(self):
+        """
+        Ferma pipe-pane e chiude il writer fittizio: quando cat esce il lettore
+        riceve EOF dopo aver svuotato la FIFO e completa la chiusura
+        """
+        self.stopping = True
+        run_local_tmux(self.ctx, 'pipe-pane', '-t', self.pane_id)
+        if self.keepalive_fd is not None:
+            os.close(self.keepalive_fd)
+            self.keepalive_fd = None
+
+def get_recording_dir(username, recording_id):
+    """Directory di una registrazione dell'utente, o None se non esiste"""
+    if not recording_id or not recording_id.isalnum():
+        return None
+    directory = os.path.join(RECORDINGS_DIR, username, recording_id)
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    return directory
+
+def load_recording_index(directory):
+    """Legge l'indice dei chunk di una registrazione"""
+    index_path = os.path.join(directory, 'index.jsonl')
+    if not os.path.exists(index_path):
+        return []
+    with open(index_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def iter_recording_events(directory, index, start=0.0, end=None):
+    """
+    Restituisce gli eventi tra start ed end decomprimendo un chunk alla volta,
+    partendo dal chunk che contiene start (ricerca binaria sull'indice)
+    """
+    ends = [entry['end'] for entry in index]
+    for entry in index[bisect.bisect_left(ends, start):]:
+        if end is not None and entry['start'] > end:
+            break
+        with gzip.open(os.path.join(directory, entry['file']), 'rt', encoding='utf-8') as f:
+            for line in f:
+                event = json.loads(line)
+                if event[0] < start:
+                    continue
+                if end is not None and event[0] > end:
+                    return
+                yield event
+
+class ScrollbackIndex:
+    """
+    Indice invertito incrementale dello scrollback dei pane di un utente.
+    Documento = pane (host_id, pane_id) con le sue righe; l'indice mappa ogni
+    token alle righe che lo contengono, cosi' una ricerca non deve scorrere il
+    testo. Re-indicizzare un pane rimuove solo i suoi vecchi postings.
+    """
+
+    def __init__(self):
+        self.documents = {}  # {(host_id, pane_id): {'meta', 'lines', 'signature', 'hash'}}
+        self.postings = {}   # {token: {(host_id, pane_id): set(line_numbers)}}
+        self.indexed_at = 0
+        self.last_used = time.monotonic()  # ultimo login o ricerca dell'utente
+        self.refreshing = False
+
+    def signature(self, key):
+        """Firma (history_size, attivita') dell'ultima indicizzazione del pane"""
+        doc = self.documents.get(key)
+        return doc['signature'] if doc else None
+
+    def update_document(self, key, meta, signature, text):
+        """Indicizza (o re-indicizza) un pane. Returns: True se il contenuto e' cambiato"""
+        digest = hashlib.sha1(text.encode('utf-8', errors='replace')).hexdigest()
+        doc = self.documents.get(key)
+        if doc and doc['hash'] == digest:
+            doc['meta'] = meta
+            doc['signature'] = signature
+            return False
+
+        self.remove_document(key)
+        lines = text.rstrip('\n').split('\n')
+        for line_number, line in enumerate(lines):
+            for token in set(tokenize_search_text(line)):
+                self.postings.setdefault(token, {}).setdefault(key, set()).add(line_number)
+
+        self.documents[key] = {'meta': meta, 'lines': lines, 'signature': signature, 'hash': digest}
+        return True
+
+    def remove_document(self, key):
+        """Rimuove un pane e i suoi postings"""
+        doc = self.documents.pop(key, None)
+        if doc is None:
+            return
+        for line in doc['lines']:
+            for token in set(tokenize_search_text(line)):
+                by_doc = self.postings.get(token)
+                if by_doc is None:
+                    continue
+                by_doc.pop(key, None)
+                if not by_doc:
+                    del self.postings[token]
+
+    def prune_host(self, host_id, alive_keys):
+        """Rimuove i pane di un host che non esistono piu'"""
+        for key in [k for k in self.documents if k[0] == host_id and k not in alive_keys]:
+            self.remove_document(key)
+
+    def search(self, query, limit=50, context=1):
+        """Righe che contengono tutti i token della query, con righe di contesto"""
+        tokens = set(tokenize_search_text(query))
+        if not tokens:
+            return []
+
+        # Parti dal token piu' raro per ridurre le intersezioni
+        ordered = sorted(tokens, key=lambda t: len(self.postings.get(t, {})))
+        candidates = dict(self.postings.get(ordered[0], {}))
+        for token in ordered[1:]:
+            by_doc = self.postings.get(token, {})
+            candidates = {k: lines & by_doc[k] for k, lines in candidates.items() if k in by_doc}
+            candidates = {k: lines for k, lines in candidates.items() if lines}
+            if not candidates:
+                return []
+
+        results = []
+        for key, line_numbers in candidates.items():
+            doc = self.documents[key]
+            for line_number in sorted(line_numbers):
+                results.append(dict(doc['meta'],
+                    line_number=line_number,
+                    line=doc['lines'][line_number],
+                    context_before=doc['lines'][max(0, line_number - context):line_number],
+                    context_after=doc['lines'][line_number + 1:line_number + 1 + context]
+                ))
+                if len(results) >= limit:
+                    return results
+        return results
+
+def tokenize_search_text(text):
+    """Token di ricerca: parole alfanumeriche in minuscolo (almeno 2 caratteri)"""
+    return [t for t in SEARCH_TOKEN_RE.findall(text.lower()) if len(t) > 1]
+
+def parse_pane_listing(lines, host_id, host_name):
+    """Interpreta l'output di list-panes con PANE_LIST_FORMAT"""
+    panes = []
+    for line in lines:
+        parts = line.split('|')
+        if len(parts) < 7:
+            continue
+        pane_id, history_size, activity = parts[0], parts[1], parts[2]
+        window_index, pane_index = parts[-2], parts[-1]
+        session_name, window_name = parts[3], '|'.join(parts[4:-2])
+        panes.append({
+            'key': (host_id, pane_id),
+            'signature': f'{history_size}|{activity}',
+            'meta': {
+                'host_id': host_id,
+                'host_name': host_name,
+                'session_name': session_name,
+                'window_index': window_index,
+                'window_name': window_name,
+                'pane_index': pane_index,
+                'pane_id': pane_id,
+            }
+        })
+    return panes
+
+def index_local_panes(ctx, index):
+    """Indicizza i pane locali modificati tramite il client control mode"""
+    if not os.path.exists(ctx.socket_path):
+        index.prune_host('local', set())
+        return
+
+    ok, lines, _ = run_local_tmux(ctx, 'list-panes', '-a', '-F', PANE_LIST_FORMAT)
+    if not ok:
+        return
+
+    panes = parse_pane_listing(lines, 'local', 'Local')
+    for pane in panes:
+        if index.signature(pane['key']) == pane['signature']:
+            continue
+        ok, content, _ = run_local_tmux(
+            ctx, 'capture-pane', '-p', '-J', '-S', f'-{SEARCH_HISTORY_LINES}', '-t', pane['meta']['pane_id']
+        )
+        if ok and index.update_document(pane['key'], pane['meta'], pane['signature'], '\n'.join(content)):
+            metrics['search_panes_indexed'] += 1
+
+    index.prune_host('local', {p['key'] for p in panes})
+
+def run_remote_tmux_script(host_config, ctx, script, timeout=15):
+    """Esegue uno script shell sull'host remoto come l'utente. Returns: righe di stdout o None"""
+    ssh_cmd = [
+        'ssh',
+        '-p', str(host_config.get('port', 22)),
+        '-o', 'StrictHostKeyChecking=no',
+        '-o', 'UserKnownHostsFile=/dev/null',
+        '-o', 'ConnectTimeout=2',
+        '-o', 'BatchMode=yes',
+        f"{host_config.get('username') or ctx.username}@{host_config['hostname']}",
+        script
+    ]
+    result = green_subprocess.run(
+        ssh_cmd,
+        capture_output=True,
+        text=True,
+        timeout=timeout,
+        env=ctx.ssh_env,
+        user=ctx.uid,
+        group=ctx.gid
+    )
+    if result.returncode != 0:
+        return None
+    return result.stdout.splitlines()
+
+def index_remote_panes(host_config, ctx, index):
+    """
+    Indicizza i pane modificati di un host remoto: una chiamata SSH per la
+    lista (con history_size/attivita') e una sola per catturare i pane cambiati
+    """
+    host_id = host_config['id']
+    host_name = host_config.get('name', host_config['hostname'])
+
+    lines = run_remote_tmux_script(host_config, ctx, f"tmux list-panes -a -F '{PANE_LIST_FORMAT}' 2>/dev/null")
+    if lines is None:
+        return
+
+    panes = parse_pane_listing(lines, host_id, host_name)
+    changed = [p for p in panes if index.signature(p['key']) != p['signature']]
+
+    if changed:
+        marker = f'@@WB-{secrets.token_hex(8)}'
+        script = '; '.join(
+            f"echo '{marker} {p['meta']['pane_id']}'; tmux capture-pane -p -J -S -{SEARCH_HISTORY_LINES} -t '{p['meta']['pane_id']}'"
+            for p in changed
+        )
+        output = run_remote_tmux_script(host_config, ctx, script, 60)
+        if output is not None:
+            captured = {}
+            current = None
+            for line in output:
+                if line.startswith(marker + ' '):
+                    current = line[len(marker) + 1:]
+                    captured[current] = []
+                elif current is not None:
+                    captured[current].append(line)
+
+            for pane in changed:
+                content = captured.get(pane['meta']['pane_id'])
+                if content is not None and index.update_document(pane['key'], pane['meta'], pane['signature'], '\n'.join(content)):
+                    metrics['search_panes_indexed'] += 1
+
+    index.prune_host(host_id, {p['key'] for p in panes})
+
+def use_search_index(username):
+    """
+    Indice dell'utente per un login o una ricerca: lo crea se manca, ne
+    rinnova la scadenza e avvia la prima indicizzazione in background
+    """
+    index = search_indexes.setdefault(username, ScrollbackIndex())
+    index.last_used = time.monotonic()
+    if index.indexed_at == 0 and not index.refreshing:
+        eventlet.spawn_n(refresh_search_index, username)
+    return index
+
+def refresh_search_index(username):
+    """Aggiorna l'indice di ricerca di un utente (pane locali e remoti)"""
+    index = search_indexes.setdefault(username, ScrollbackIndex())
+    if index.refreshing:
+        return
+    index.refreshing = True
+    try:
+        update_search_index(username, index)
+    finally:
+        index.refreshing = False
+
+def update_search_index(username, index):
+    """Indicizza i pane locali e quelli degli host abilitati dell'utente"""
+    ctx = get_user_context(username)
+
+    try:
+        index_local_panes(ctx, index)
+    except Exception as e:
+        import sys
+        sys.stderr.write(f"[SEARCH] Local indexing failed for {username}: {e}\n")
+        sys.stderr.flush()
+
+    def index_host(host):
+        try:
+            index_remote_panes(host, ctx, index)
+        except Exception as e:
+            import sys
+            sys.stderr.write(f"[SEARCH] Indexing failed for {host.get('hostname', 'unknown')}: {e}\n")
+            sys.stderr.flush()
+
+    pool = eventlet.GreenPool(REMOTE_FETCH_CONCURRENCY)
+    for host in ctx.enabled_hosts:
+        pool.spawn_n(index_host, host)
+    pool.waitall()
+
+    # Host rimossi o disabilitati
+    active_host_ids = {'local'} | {h['id'] for h in ctx.enabled_hosts}
+    for key in [k for k in index.documents if k[0] not in active_host_ids]:
+        index.remove_document(key)
+
+    index.indexed_at = time.time()
+
+def search_indexer_loop():
+    """Green thread che aggiorna periodicamente gli indici degli utenti attivi"""
+    import sys
+    while True:
+        eventlet.sleep(SEARCH_INDEX_INTERVAL)
+        now = time.monotonic()
+        for username, index in list(search_indexes.items()):
+            if now - index.last_used > SEARCH_INDEX_TTL:
+                # Nessun login ne' ricerca da tempo: si smette di catturare i suoi host
+                del search_indexes[username]
+                continue
+            try:
+                refresh_search_index(username)
+            except KeyError:
+                # Utente non piu' risolvibile (rimosso dal sistema o NSS non disponibile)
+                search_indexes.pop(username, None)
+                sys.stderr.write(f"[SEARCH] Dropping index of unknown user {username}\n")
+                sys.stderr.flush()
+            except Exception as e:
+                sys.stderr.write(f"[SEARCH] Refresh failed for {username}: {e}\n")
+                sys.stderr.flush()
+
+def capture_host_previews(ctx, host_id):
+    """
+    Cattura il testo visibile del pane attivo di tutte le sessioni di un host
+    in un'unica operazione (control mode in locale, una chiamata SSH in remoto).
+    Returns: {session_name: [righe]} oppure None se l'host non risponde
+    """
+    if host_id == 'local':
+        if not os.path.exists(ctx.socket_path):
+            return {}
+        ok, names, _ = run_local_tmux(ctx, 'list-sessions', '-F', '#{session_name}')
+        if not ok:
+            return {}
+        previews = {}
+        for name in names:
+            ok, lines, _ = run_local_tmux(ctx, 'capture-pane', '-p', '-t', f'={name}:')
+            if ok:
+                previews[name] = lines
+        return previews
+
+    host_config = ctx.get_host(host_id)
+    if host_config is None:
+        return None
+
+    marker = f'@@WB-{secrets.token_hex(8)}'
+    script = (
+        "tmux list-sessions -F '#{session_name}' 2>/dev/null | while IFS= read -r s; do "
+        f"echo '{marker}' \"$s\"; tmux capture-pane -p -t \"=$s:\"; done"
+    )
+    output = run_remote_tmux_script(host_config, ctx, script)
+    if output is None:
+        return None
+
+    previews = {}
+    current = None
+    for line in output:
+        if line.startswith(marker + ' '):
+            current = line[len(marker) + 1:]
+            previews[current] = []
+        elif current is not None:
+            previews[current].append(line)
+    return previews
+
+def get_host_previews(ctx, host_id):
+    """
+    Anteprime di un host dalla cache. Una nuova cattura parte solo se la cache
+    e' piu' vecchia di PREVIEW_CACHE_TTL, e comunque non piu' di una volta ogni
+    PREVIEW_MIN_INTERVAL per host (anche se la cattura precedente e' fallita);
+    le richieste concorrenti condividono la stessa cattura.
+    Returns: None se l'host non e' tra quelli dell'utente (niente cache)
+    """
+    if host_id != 'local' and ctx.get_host(host_id) is None:
+        return None
+
+    key = (ctx.username, host_id)
+    entry = preview_cache.get(key)
+    now = time.monotonic()
+    prune_preview_cache(now)
+
+    if entry and now - entry['fetched_at'] < max(PREVIEW_CACHE_TTL, PREVIEW_MIN_INTERVAL):
+        metrics['preview_cache_hits'] += 1
+        entry['used_at'] = now
+        return entry
+
+    inflight = preview_fetches_inflight.get(key)
+    if inflight is not None:
+        return inflight.wait()
+
+    event = Event()
+    preview_fetches_inflight[key] = event
+    previous = entry['sessions'] if entry else {}
+    # Se la cattura fallisce (host irraggiungibile, timeout, errore) si tengono
+    # le ultime anteprime note e il fallimento conta per PREVIEW_MIN_INTERVAL
+    entry = {'sessions': previous, 'fetched_at': time.monotonic(), 'used_at': now}
+    try:
+        previews = capture_host_previews(ctx, host_id)
+        metrics['preview_captures'] += 1
+        if previews is not None:
+            sessions = {}
+            for name, lines in previews.items():
+                version = hashlib.sha1('\n'.join(lines).encode('utf-8', errors='replace')).hexdigest()[:12]
+                history = previous.get(name, {}).get('versions', {})
+                if version not in history:
+                    history[version] = lines
+                    # Conserva solo le ultime versioni, per i diff verso i client
+                    while len(history) > PREVIEW_VERSIONS_KEPT:
+                        del history[next(iter(history))]
+                sessions[name] = {'version': version, 'versions': history}
+            entry = {'sessions': sessions, 'fetched_at': time.monotonic(), 'used_at': now}
+    except Exception as e:
+        import sys
+        sys.stderr.write(f"[PREVIEW] Capture failed on {host_id} for {ctx.username}: {e}\n")
+        sys.stderr.flush()
+    finally:
+        preview_cache[key] = entry
+        del preview_fetches_inflight[key]
+        event.send(entry)
+    return entry
+
+def prune_preview_cache(now):
+    """Scarta (al massimo una volta al minuto) le anteprime non richieste da PREVIEW_CACHE_EXPIRE secondi"""
+    global preview_cache_pruned_at
+    if now - preview_cache_pruned_at < 60:
+        return
+    preview_cache_pruned_at = now
+    for key in [k for k, v in preview_cache.items() if now - v['used_at'] > PREVIEW_CACHE_EXPIRE]:
+        del preview_cache[key]
+
+def diff_preview_lines(old_lines, new_lines):
+    """Diff per riga: [[indice, testo]] delle righe cambiate"""
+    changes = []
+    for i, line in enumerate(new_lines):
+        if i >= len(old_lines) or old_lines[i] != line:
+            changes.append([i, line])
+    return changes
+
+def compact_sessions(sessions, host_table):
+    """
+    Forma compatta del listing: ogni sessione diventa una riga
+    [indice host, id, name, created, windows, attached] e nome e colore
+    dell'host viaggiano una sola volta nella tabella degli host.
+    host_table: {host_id: [indice, nome, colore]} gia' noti al client (viene aggiornata)
+    Returns: (voci nuove o cambiate della tabella [[indice, host_id, nome, colore]], righe)
+    """
+    new_hosts = []
+    rows = []
+    for s in sessions:
+        host_id = s['host_id']
+        entry = host_table.get(host_id)
+        if entry is None or entry[1] != s['host_name'] or entry[2] != s['host_color']:
+            index = entry[0] if entry else len(host_table)
+            entry = host_table[host_id] = [index, s['host_name'], s['host_color']]
+            new_hosts.append([index, host_id, s['host_name'], s['host_color']])
+        rows.append([entry[0]] + [s[field] for field in SESSION_ROW_FIELDS])
+    return new_hosts, rows
+
+def get_socket_encoding():
+    """Codifica negoziata dal client Socket.IO corrente ('json' se non negoziata)"""
+    state = socket_encodings.get(request.sid)
+    return state['encoding'] if state else 'json'
+
+def emit_encoded(event, payload):
+    """Emette un evento nella codifica del client: i client msgpack ricevono un payload binario"""
+    if get_socket_encoding() == 'msgpack':
+        emit(event, msgpack.packb(payload, use_bin_type=True))
+    else:
+        emit(event, payload)
+
+def sessions_chunk_payload(request_id, host_id, sessions):
+    """Payload di 'sessions_chunk' nella codifica del client corrente"""
+    payload = {'request_id': request_id, 'host_id': host_id}
+    if get_socket_encoding() == 'json':
+        payload['sessions'] = sessions
+    else:
+        payload['hosts'], payload['rows'] = compact_sessions(sessions, socket_encodings[request.sid]['hosts'])
+    return payload
+
+def benchmark_session_encodings(sessions):
+    """
+    Dimensione (anche dopo gzip) e tempo di codifica di un listing nelle
+    varianti JSON, JSON compatto e MessagePack
+    """
+    listing = {'sessions': sessions}
+    compact = dict(zip(('hosts', 'rows'), compact_sessions(sessions, {})))
+    encoders = {
+        'json': lambda: json.dumps(listing, separators=(',', ':')).encode(),
+        'compact_json': lambda: json.dumps(compact, separators=(',', ':')).encode(),
+    }
+    if msgpack is not None:
+        encoders['msgpack'] = lambda: msgpack.packb(listing, use_bin_type=True)
+        encoders['compact_msgpack'] = lambda: msgpack.packb(compact, use_bin_type=True)
+
+    results = {}
+    for name, encode in encoders.items():
+        started = time.perf_counter()
+        for _ in range(10):
+            data = encode()
+        results[name] = {
+            'bytes': len(data),
+            'gzip_bytes': len(gzip.compress(data)),
+            'encode_ms': round((time.perf_counter() - started) * 100, 3)
+        }
+    return results
+
+def is_admin(username):
+    """True se l'utente puo' usare le funzioni di amministrazione"""
+    return username in ADMIN_USERS
+
+def profiled(name):
+    """
+    Decoratore per gli handler profilabili su richiesta. Con il profiling
+    spento il costo e' un solo lookup nel dict profiled_handlers.
+    """
+    PROFILABLE_HANDLERS.add(name)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            target = profiled_handlers.get(name)
+            if target is None:
+                return fn(*args, **kwargs)
+            return run_profiled(name, target, fn, args, kwargs)
+        return wrapper
+    return decorator
+
+def run_profiled(name, target, fn, args, kwargs):
+    """
+    Esegue l'handler sotto cProfile e accumula le statistiche. Con eventlet i
+    green thread condividono il thread OS: mentre l'handler e' sospeso anche gli
+    altri green thread finiscono nel profilo, e se un'altra chiamata e' gia'
+    profilata questa viene eseguita senza profilo.
+    """
+    global profile_active
+
+    if time.monotonic() > target['until']:
+        finish_handler_profiling(name)
+        return fn(*args, **kwargs)
+
+    # Prima di Python 3.12 un secondo enable() sostituisce in silenzio il
+    # profiler attivo, e il disable() della prima chiamata spegnerebbe l'altro
+    if profile_active:
+        target['skipped'] += 1
+        return fn(*args, **kwargs)
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # 3.12+: un altro strumento sta gia' profilando questo thread
+        target['skipped'] += 1
+        return fn(*args, **kwargs)
+
+    profile_active = True
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        profile.disable()
+        profile_active = False
+        target['calls'] += 1
+        if target['stats'] is None:
+            target['stats'] = pstats.Stats(profile)
+        else:
+            target['stats'].add(profile)
+
+def finish_handler_profiling(name):
+    """Chiude il profiling di un handler e ne conserva il risultato"""
+    target = profiled_handlers.pop(name, None)
+    if target is not None:
+        target['stopped_at'] = time.time()
+        profile_results[name] = target
+
+def sample_main_thread(result, duration, interval):
+    """
+    Campionatore in un thread OS separato: legge lo stack del thread principale
+    (quello del loop eventlet) e conta gli stack in formato flamegraph
+    ("funz1;funz2;funz3 N")
+    """
+    main_id = threading.main_thread().ident
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline and not result['cancelled']:
+        frame = sys._current_frames().get(main_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+            frame = frame.f_back
+        if stack:
+            key = ';'.join(reversed(stack))
+            with result['lock']:
+                result['stacks'][key] = result['stacks'].get(key, 0) + 1
+            result['samples'] += 1
+        time.sleep(interval)
+    result['stopped_at'] = time.time()
+
+def start_sampling_profiler(duration, interval):
+    """Avvia il profiling a campionamento per una finestra di tempo"""
+    result = {
+        'mode': 'sampling',
+        'started_at': time.time(),
+        'stopped_at': None,
+        'duration': duration,
+        'interval': interval,
+        'samples': 0,
+        'stacks': {},
+        'lock': threading.Lock(),  # stacks e' aggiornato dal thread del campionatore
+        'cancelled': False,
+    }
+    profile_results[SAMPLING_PROFILE_NAME] = result
+    threading.Thread(target=sample_main_thread, args=(result, duration, interval), daemon=True).start()
+    return result
+
+def describe_profile(name, target):
+    """Riepilogo JSON di un profilo (attivo o concluso)"""
+    summary = {k: v for k, v in target.items() if k not in ('stats', 'stacks', 'lock', 'cancelled', 'until')}
+    summary['name'] = name
+    if 'until' in target:
+        summary['remaining'] = max(0, round(target['until'] - time.monotonic(), 1))
+    return summary
+
+def find_ttyd_instance(username, host_id, session_name):
+    """Cerca un ttyd gia' attivo per questa sessione, host e utente"""
+    for tid, instance in ttyd_instances.items():
+        if (instance['session_name'] == session_name and
+            instance['username'] == username and
+            instance.get('host_id', 'local') == host_id):
+            return tid, instance['port']
+    return None, None
+
+def spawn_ttyd_single_flight(session_name, ctx, host_id):
+    """
+    Avvia ttyd con semantica single-flight: il primo chiamante esegue lo spawn,
+    quelli concorrenti per la stessa (utente, host, sessione) attendono lo
+    stesso risultato invece di creare processi e config nginx duplicati.
+    Lo spawn passa dal controllo di ammissione; un AdmissionError viene
+    propagato anche a chi era in attesa.
+    Returns: (terminal_id, port, coalesced)
+    """
+    key = (ctx.username, host_id, session_name)
+
+    inflight = ttyd_spawns_inflight.get(key)
+    if inflight is not None:
+        metrics['ttyd_spawns_coalesced'] += 1
+        terminal_id, port = inflight.wait()
+        return terminal_id, port, True
+
+    event = Event()
+    ttyd_spawns_inflight[key] = event
+    try:
+        with terminal_spawn_slot(ctx.username):
+            result = start_ttyd(session_name, ctx, host_id)
+        if result[0] is not None:
+            metrics['ttyd_spawns'] += 1
+    except Exception as e:
+        del ttyd_spawns_inflight[key]
+        event.send_exception(e)
+        raise
+
+    del ttyd_spawns_inflight[key]
+    event.send(result)
+
+    terminal_id, port = result
+    return terminal_id, port, False
+
+@app.route('/assets/<path:filename>')
+def assets(filename):
+    """
+    Asset fingerprint con cache immutabile e variante precompressa secondo
+    Accept-Encoding (in remote mode queste richieste le serve nginx)
+    """
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if encoding in request.accept_encodings and os.path.exists(os.path.join(ASSETS_DIR, filename + suffix)):
+            response = send_from_directory(ASSETS_DIR, filename + suffix, mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(ASSETS_DIR, filename, mimetype=mimetype)
+
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
 @app.route('/')
 def index():
     """Pagina principale - reindirizza al login se non autenticato"""
@@ -502,18 +2326,35 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        ip = get_client_ip()
 
-        if authenticate_user(username, password):
+        # Rifiuta subito i tentativi in backoff, senza interpellare PAM
+        retry_after = get_login_retry_after(username, ip)
+        if retry_after > 0:
+            metrics['login_throttled'] += 1
+            return render_template('login.html', error=f'Too many failed attempts, retry in {int(retry_after) + 1}s', hostname=HOSTNAME), 429
+
+        try:
+            authenticated = authenticate_user(username, password)
+        except AuthBusyError:
+            return render_template('login.html', error='Server busy, please retry shortly', hostname=HOSTNAME), 503
+
+        if authenticated:
+            clear_login_failures(username, ip)
             session['username'] = username
             try:
-                user_info = pwd.getpwnam(username)
-                session['uid'] = user_info.pw_uid
-                session['gid'] = user_info.pw_gid
-                session['home'] = user_info.pw_dir
+                # Ricarica il contesto al login (host e dati NSS freschi)
+                invalidate_user_context(username)
+                ctx = get_user_context(username)
+                use_search_index(username)
+                session['uid'] = ctx.uid
+                session['gid'] = ctx.gid
+                session['home'] = ctx.home
             except:
                 pass
             return redirect(url_for('index'))
         else:
+            record_login_failure(username, ip)
             return render_template('login.html', error='Invalid credentials', hostname=HOSTNAME)
 
     return render_template('login.html', hostname=HOSTNAME)
@@ -525,15 +2366,39 @@ def logout():
     return redirect(url_for('login'))
 
 @app.route('/api/sessions')
+@profiled('api_sessions')
 def api_sessions():
-    """API per ottenere le sessioni tmux (locali e remote)"""
+    """
+    API per ottenere le sessioni tmux (locali e remote).
+    Filtri opzionali: ?group=, ?hosts=id1,id2, ?lazy=1&expanded=g1,g2
+    Con ?compact=1 le sessioni arrivano come righe con una tabella degli host,
+    in MessagePack se il client lo accetta (Accept: application/x-msgpack)
+    """
     if 'username' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    sessions = get_all_sessions(session.get('username'))
-    return jsonify({'sessions': sessions})
+    ctx = get_user_context(session.get('username'))
+    hosts, include_local = select_hosts(ctx, **parse_host_selection(request.args))
+    sessions = get_all_sessions(ctx, hosts, include_local)
+    payload = {
+        'host_ids': (['local'] if include_local else []) + [h['id'] for h in hosts],
+        'groups': get_host_groups(ctx.enabled_hosts)
+    }
+
+    if request.args.get('compact') != '1':
+        payload['sessions'] = sessions
+        return jsonify(payload)
+
+    payload['hosts'], payload['rows'] = compact_sessions(sessions, {})
+    if msgpack is not None and request.accept_mimetypes.best_match(['application/json', 'application/x-msgpack']) == 'application/x-msgpack':
+        response = Response(msgpack.packb(payload, use_bin_type=True), mimetype='application/x-msgpack')
+    else:
+        response = jsonify(payload)
+    response.headers['Vary'] = 'Accept'
+    return response
 
 @app.route('/api/session/rename', methods=['POST'])
+@profiled('api_session_rename')
 def api_session_rename():
     """API per rinominare una sessione tmux"""
     if 'username' not in session:
@@ -549,25 +2414,21 @@ def api_session_rename():
         return jsonify({'error': 'Missing old_name or new_name'}), 400
 
     try:
-        import pwd
-        user_info = pwd.getpwnam(username)
-        uid = user_info.pw_uid
-        gid = user_info.pw_gid
+        ctx = get_user_context(username)
+        uid = ctx.uid
+        gid = ctx.gid
 
         if host_id == 'local':
             # Rename local tmux session
-            socket_path = f'{TMUX_SOCKET_BASE}{uid}/default'
-            cmd = ['tmux', '-S', socket_path, 'rename-session', '-t', old_name, new_name]
-            result = subprocess.run(cmd, capture_output=True, text=True, preexec_fn=demote(uid, gid))
+            ok, _, error = run_local_tmux(ctx, 'rename-session', '-t', old_name, new_name)
 
-            if result.returncode == 0:
+            if ok:
                 return jsonify({'success': True, 'message': 'Session renamed successfully', 'refresh_sessions': True})
             else:
-                return jsonify({'error': f'Failed to rename session: {result.stderr}'}), 500
+                return jsonify({'error': f'Failed to rename session: {error}'}), 500
         else:
             # Rename remote tmux session via SSH
-            hosts = load_user_hosts(username)
-            host_config = next((h for h in hosts if h['id'] == host_id), None)
+            host_config = ctx.get_host(host_id)
 
             if not host_config:
                 return jsonify({'error': 'Host not found'}), 404
@@ -591,7 +2452,9 @@ def api_session_rename():
                 capture_output=True,
                 text=True,
                 timeout=10,
-                preexec_fn=demote(uid, gid)
+                env=ctx.ssh_env,
+                user=uid,
+                group=gid
             )
 
             if result.returncode == 0:
@@ -606,6 +2469,7 @@ def api_session_rename():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/session/create', methods=['POST'])
+@profiled('api_session_create')
 def api_session_create():
     """API per creare una nuova sessione tmux"""
     if 'username' not in session:
@@ -620,36 +2484,23 @@ def api_session_create():
         return jsonify({'error': 'Session name is required'}), 400
 
     try:
-        import pwd
         import sys
 
-        user_info = pwd.getpwnam(username)
-        uid = user_info.pw_uid
-        gid = user_info.pw_gid
+        ctx = get_user_context(username)
+        uid = ctx.uid
+        gid = ctx.gid
 
         if host_id == 'local':
             # Crea sessione tmux locale
-            socket_path = f'{TMUX_SOCKET_BASE}{uid}/default'
-
             sys.stderr.write(f"[CREATE] Creating local session {session_name} for user {username}\n")
             sys.stderr.flush()
 
-            cmd = [
-                'tmux', '-S', socket_path,
-                'new-session', '-d', '-s', session_name
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                preexec_fn=demote(uid, gid)
-            )
+            ok, _, error = run_local_tmux(ctx, 'new-session', '-d', '-s', session_name)
 
-            if result.returncode != 0:
-                sys.stderr.write(f"[CREATE] Error: {result.stderr}\n")
+            if not ok:
+                sys.stderr.write(f"[CREATE] Error: {error}\n")
                 sys.stderr.flush()
-                return jsonify({'error': f'Failed to create session: {result.stderr}'}), 500
+                return jsonify({'error': f'Failed to create session: {error}'}), 500
 
             sys.stderr.write(f"[CREATE] Session {session_name} created successfully\n")
             sys.stderr.flush()
@@ -662,8 +2513,7 @@ def api_session_create():
 
         else:
             # Crea sessione tmux remota via SSH
-            hosts = load_user_hosts(username)
-            host_config = next((h for h in hosts if h['id'] == host_id), None)
+            host_config = ctx.get_host(host_id)
 
             if not host_config:
                 return jsonify({'error': 'Host not found'}), 404
@@ -689,7 +2539,9 @@ def api_session_create():
                 ssh_cmd,
                 capture_output=True,
                 text=True,
-                preexec_fn=demote(uid, gid)
+                env=ctx.ssh_env,
+                user=uid,
+                group=gid
             )
 
             if result.returncode != 0:
@@ -713,6 +2565,7 @@ def api_session_create():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/session/delete', methods=['POST'])
+@profiled('api_session_delete')
 def api_session_delete():
     """API per eliminare una sessione tmux"""
     if 'username' not in session:
@@ -727,36 +2580,23 @@ def api_session_delete():
         return jsonify({'error': 'Session name is required'}), 400
 
     try:
-        import pwd
         import sys
 
-        user_info = pwd.getpwnam(username)
-        uid = user_info.pw_uid
-        gid = user_info.pw_gid
+        ctx = get_user_context(username)
+        uid = ctx.uid
+        gid = ctx.gid
 
         if host_id == 'local':
             # Elimina sessione tmux locale
-            socket_path = f'{TMUX_SOCKET_BASE}{uid}/default'
-
             sys.stderr.write(f"[DELETE] Deleting local session {session_name} for user {username}\n")
             sys.stderr.flush()
 
-            cmd = [
-                'tmux', '-S', socket_path,
-                'kill-session', '-t', session_name
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                preexec_fn=demote(uid, gid)
-            )
+            ok, _, error = run_local_tmux(ctx, 'kill-session', '-t', session_name)
 
-            if result.returncode != 0:
-                sys.stderr.write(f"[DELETE] Error: {result.stderr}\n")
+            if not ok:
+                sys.stderr.write(f"[DELETE] Error: {error}\n")
                 sys.stderr.flush()
-                return jsonify({'error': f'Failed to delete session: {result.stderr}'}), 500
+                return jsonify({'error': f'Failed to delete session: {error}'}), 500
 
             sys.stderr.write(f"[DELETE] Session {session_name} deleted successfully\n")
             sys.stderr.flush()
@@ -770,8 +2610,7 @@ def api_session_delete():
 
         else:
             # Elimina sessione tmux remota via SSH
-            hosts = load_user_hosts(username)
-            host_config = next((h for h in hosts if h['id'] == host_id), None)
+            host_config = ctx.get_host(host_id)
 
             if not host_config:
                 return jsonify({'error': 'Host not found'}), 404
@@ -797,7 +2636,9 @@ def api_session_delete():
                 ssh_cmd,
                 capture_output=True,
                 text=True,
-                preexec_fn=demote(uid, gid)
+                env=ctx.ssh_env,
+                user=uid,
+                group=gid
             )
 
             if result.returncode != 0:
@@ -827,7 +2668,7 @@ def api_hosts_list():
     if 'username' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
-    hosts = load_user_hosts(session.get('username'))
+    hosts = [dict(h, groups=host_group_names(h)) for h in load_user_hosts(session.get('username'))]
     return jsonify({'hosts': hosts})
 
 @app.route('/api/hosts', methods=['POST'])
@@ -846,6 +2687,11 @@ def api_hosts_add():
     # Load existing hosts
     hosts = load_user_hosts(username)
 
+    try:
+        groups = normalize_host_groups(data.get('groups', []))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     # Generate unique ID
     import uuid
     new_host = {
@@ -854,7 +2700,8 @@ def api_hosts_add():
         'hostname': data['hostname'],
         'port': data.get('port', 22),
         'username': data.get('username', username),
-        'enabled': data.get('enabled', True)
+        'enabled': data.get('enabled', True),
+        'groups': groups
     }
 
     hosts.append(new_host)
@@ -878,13 +2725,19 @@ def api_hosts_update(host_id):
 
     for i, host in enumerate(hosts):
         if host['id'] == host_id:
+            try:
+                groups = normalize_host_groups(data.get('groups', host_group_names(host)))
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+
             # Update fields
             hosts[i].update({
                 'name': data.get('name', host.get('name')),
                 'hostname': data.get('hostname', host['hostname']),
                 'port': data.get('port', host.get('port', 22)),
                 'username': data.get('username', host.get('username')),
-                'enabled': data.get('enabled', host.get('enabled', True))
+                'enabled': data.get('enabled', host.get('enabled', True)),
+                'groups': groups
             })
             host_found = True
             break
@@ -913,6 +2766,385 @@ def api_hosts_delete(host_id):
     else:
         return jsonify({'error': 'Failed to save host'}), 500
 
+@app.route('/api/recordings', methods=['GET'])
+def api_recordings_list():
+    """Elenco delle registrazioni dell'utente"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    username = session.get('username')
+    user_dir = os.path.join(RECORDINGS_DIR, username)
+    recordings = []
+    if os.path.isdir(user_dir):
+        for recording_id in sorted(os.listdir(user_dir)):
+            meta_path = os.path.join(user_dir, recording_id, 'meta.json')
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            meta['active'] = recording_id in active_recordings
+            recordings.append(meta)
+
+    return jsonify({'recordings': recordings})
+
+@app.route('/api/recordings', methods=['POST'])
+def api_recordings_start():
+    """Avvia la registrazione del pane attivo di una sessione tmux locale"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    data = request.get_json()
+    session_name = data.get('session_name')
+    host_id = data.get('host_id', 'local')
+
+    if not session_name:
+        return jsonify({'error': 'Session name is required'}), 400
+    if host_id != 'local':
+        return jsonify({'error': 'Recording is only supported for local sessions'}), 400
+
+    try:
+        import uuid
+        recorder = SessionRecorder(uuid.uuid4().hex[:12], get_user_context(session.get('username')), session_name)
+        recorder.start()
+        active_recordings[recorder.recording_id] = recorder
+    except Exception as e:
+        import sys
+        sys.stderr.write(f"[RECORD] Error starting recording of {session_name}: {e}\n")
+        sys.stderr.flush()
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'success': True, 'recording_id': recorder.recording_id})
+
+@app.route('/api/recordings/<recording_id>/stop', methods=['POST'])
+def api_recordings_stop(recording_id):
+    """Ferma una registrazione in corso"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    recorder = active_recordings.get(recording_id)
+    if recorder is None or recorder.ctx.username != session.get('username'):
+        return jsonify({'error': 'Recording not active'}), 404
+
+    recorder.stop()
+    return jsonify({'success': True})
+
+@app.route('/api/recordings/<recording_id>/index')
+def api_recordings_index(recording_id):
+    """Metadati e indice dei chunk di una registrazione (per il seek)"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    directory = get_recording_dir(session.get('username'), recording_id)
+    if directory is None:
+        return jsonify({'error': 'Recording not found'}), 404
+
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    return jsonify({'recording': meta, 'chunks': load_recording_index(directory)})
+
+@app.route('/api/recordings/<recording_id>/stream')
+def api_recordings_stream(recording_id):
+    """
+    Replay in streaming (asciicast v2, un evento JSON per riga) a partire da
+    ?from=<secondi> fino a ?to=<secondi>: i chunk vengono letti uno alla volta
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    directory = get_recording_dir(session.get('username'), recording_id)
+    if directory is None:
+        return jsonify({'error': 'Recording not found'}), 404
+
+    try:
+        start = float(request.args.get('from', 0))
+        end = float(request.args['to']) if 'to' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid from/to'}), 400
+
+    with open(os.path.join(directory, 'meta.json')) as f:
+        meta = json.load(f)
+    index = load_recording_index(directory)
+
+    def generate():
+        header = {
+            'version': 2,
+            'width': meta.get('width', 80),
+            'height': meta.get('height', 24),
+            'timestamp': int(meta.get('started_at') or 0),
+            'title': meta.get('session_name'),
+        }
+        yield json.dumps(header) + '\n'
+        for event in iter_recording_events(directory, index, start, end):
+            yield json.dumps(event) + '\n'
+
+    return Response(generate(), mimetype='application/x-asciicast')
+
+@app.route('/api/search')
+@profiled('api_search')
+def api_search():
+    """Cerca nello scrollback indicizzato di tutte le sessioni dell'utente"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query'}), 400
+
+    try:
+        limit = min(int(request.args.get('limit', 50)), 500)
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+
+    index = use_search_index(session.get('username'))
+    if index.indexed_at == 0:
+        # Prima indicizzazione ancora in corso: nessun risultato affidabile
+        return jsonify({'results': [], 'indexing': True})
+
+    started = time.perf_counter()
+    results = index.search(query, limit=limit)
+    return jsonify({
+        'results': results,
+        'indexed_at': index.indexed_at,
+        'took_ms': round((time.perf_counter() - started) * 1000, 3)
+    })
+
+@app.route('/api/preview')
+@profiled('api_preview')
+def api_preview():
+    """
+    Anteprima testuale di una sessione senza avviare ttyd. Se il client passa
+    ?version= della copia che ha gia', riceve solo le righe cambiate (o
+    'unchanged')
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    session_name = request.args.get('session_name')
+    host_id = request.args.get('host_id', 'local')
+    client_version = request.args.get('version')
+
+    if not session_name:
+        return jsonify({'error': 'Session name is required'}), 400
+
+    entry = get_host_previews(get_user_context(session.get('username')), host_id)
+    if entry is None:
+        return jsonify({'error': 'Host not found'}), 404
+    preview = entry['sessions'].get(session_name)
+    if preview is None:
+        return jsonify({'error': 'Session not found'}), 404
+
+    version = preview['version']
+    lines = preview['versions'][version]
+    response = {'session_name': session_name, 'host_id': host_id, 'version': version}
+
+    if client_version == version:
+        response['unchanged'] = True
+    elif client_version in preview['versions']:
+        response['diff'] = {
+            'base': client_version,
+            'length': len(lines),
+            'changes': diff_preview_lines(preview['versions'][client_version], lines)
+        }
+    else:
+        response['lines'] = lines
+
+    return jsonify(response)
+
+@app.route('/api/metrics')
+def api_metrics():
+    """Contatori operativi del server"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    return jsonify({
+        'metrics': metrics,
+        'ttyd_instances': len(ttyd_instances),
+        'ttyd_live': count_live_terminals(),
+        'ttyd_spawns_inflight': len(ttyd_spawns_inflight),
+        'spawn_queue_waiting': spawn_queue_waiting,
+        'terminal_resources': get_terminal_resources()['totals']
+    })
+
+@app.route('/api/admin/resources')
+def api_admin_resources():
+    """
+    Uso di CPU, memoria, fd e socket per terminale, utente e host.
+    ?sort=cpu_percent|cpu_seconds|rss_bytes|fds|sockets&limit=N per i terminali
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin only'}), 403
+
+    sort_key = request.args.get('sort', 'rss_bytes')
+    if sort_key not in ('cpu_percent', 'cpu_seconds', 'rss_bytes', 'fds', 'sockets', 'pids'):
+        return jsonify({'error': 'Invalid sort key'}), 400
+    limit = request.args.get('limit', type=int)
+
+    snapshot = get_terminal_resources()
+    terminals = [dict(entry, terminal_id=tid) for tid, entry in snapshot['terminals'].items()]
+    terminals.sort(key=lambda entry: entry[sort_key] or 0, reverse=True)
+    if limit:
+        terminals = terminals[:limit]
+
+    return jsonify({
+        'timestamp': snapshot['timestamp'],
+        'totals': snapshot['totals'],
+        'users': snapshot['users'],
+        'hosts': snapshot['hosts'],
+        'terminals': terminals
+    })
+
+@app.route('/api/admin/encoding-benchmark')
+def api_encoding_benchmark():
+    """
+    Confronta le dimensioni del listing in JSON e nelle codifiche compatte.
+    Usa le sessioni dell'utente, oppure un listing sintetico con
+    ?hosts=N&sessions_per_host=M
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin only'}), 403
+
+    synthetic_hosts = request.args.get('hosts', type=int)
+    if synthetic_hosts:
+        per_host = request.args.get('sessions_per_host', 20, type=int)
+        sessions = [
+            {
+                'id': f'${h * per_host + i}',
+                'name': f'session-{i}',
+                'created': str(1700000000 + i),
+                'windows': 1 + i % 4,
+                'attached': i % 3 == 0,
+                'host_id': f'host-{h}',
+                'host_name': f'build-server-{h}.example.com',
+                'host_color': get_host_color(f'host-{h}')
+            }
+            for h in range(min(synthetic_hosts, 1000)) for i in range(min(per_host, 1000))
+        ]
+    else:
+        sessions = get_all_sessions(get_user_context(session.get('username')))
+
+    return jsonify({
+        'sessions': len(sessions),
+        'hosts': len({s['host_id'] for s in sessions}),
+        'msgpack_available': msgpack is not None,
+        'encodings': benchmark_session_encodings(sessions)
+    })
+
+@app.route('/api/admin/profiling', methods=['GET'])
+def api_profiling_status():
+    """Stato del profiling: handler profilabili, profili attivi e conclusi"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin only'}), 403
+
+    return jsonify({
+        'handlers': sorted(PROFILABLE_HANDLERS),
+        'active': [describe_profile(n, t) for n, t in profiled_handlers.items()],
+        'results': [describe_profile(n, t) for n, t in profile_results.items()]
+    })
+
+@app.route('/api/admin/profiling', methods=['POST'])
+def api_profiling_start():
+    """
+    Avvia il profiling per duration secondi:
+    {"handler": "<nome>"} profila ogni chiamata di quell'handler con cProfile,
+    {"mode": "sampling", "interval_ms": 10} campiona lo stack del loop principale
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin only'}), 403
+
+    data = request.get_json() or {}
+    try:
+        duration = min(float(data.get('duration', 60)), PROFILING_MAX_DURATION)
+        interval = max(float(data.get('interval_ms', 10)), 1) / 1000
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid duration or interval'}), 400
+
+    if data.get('mode') == 'sampling':
+        current = profile_results.get(SAMPLING_PROFILE_NAME)
+        if current and current['stopped_at'] is None:
+            return jsonify({'error': 'Sampling already running'}), 409
+        result = start_sampling_profiler(duration, interval)
+        return jsonify({'success': True, 'profile': describe_profile(SAMPLING_PROFILE_NAME, result)})
+
+    name = data.get('handler')
+    if name not in PROFILABLE_HANDLERS:
+        return jsonify({'error': f'Unknown handler, available: {sorted(PROFILABLE_HANDLERS)}'}), 400
+
+    profiled_handlers[name] = {
+        'mode': 'handler',
+        'started_at': time.time(),
+        'until': time.monotonic() + duration,
+        'calls': 0,
+        'skipped': 0,
+        'stats': None,
+    }
+    return jsonify({'success': True, 'profile': describe_profile(name, profiled_handlers[name])})
+
+@app.route('/api/admin/profiling/<name>', methods=['DELETE'])
+def api_profiling_stop(name):
+    """Ferma un profilo attivo (i risultati restano scaricabili)"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin only'}), 403
+
+    if name in profiled_handlers:
+        finish_handler_profiling(name)
+    elif name == SAMPLING_PROFILE_NAME and name in profile_results:
+        profile_results[name]['cancelled'] = True
+    else:
+        return jsonify({'error': 'Profile not active'}), 404
+
+    return jsonify({'success': True})
+
+@app.route('/api/admin/profiling/<name>/download')
+def api_profiling_download(name):
+    """
+    Scarica un profilo: per gli handler ?format=pstats (binario, per
+    pstats/snakeviz) o text; per il campionamento stack collassati (flamegraph.pl)
+    """
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    if not is_admin(session.get('username')):
+        return jsonify({'error': 'Admin only'}), 403
+
+    target = profiled_handlers.get(name) or profile_results.get(name)
+    if target is None:
+        return jsonify({'error': 'Profile not found'}), 404
+
+    if target['mode'] == 'sampling':
+        with target['lock']:
+            stacks = list(target['stacks'].items())
+        body = ''.join(f'{stack} {count}\n' for stack, count in stacks)
+        return Response(body, mimetype='text/plain',
+                        headers={'Content-Disposition': f'attachment; filename={name}.folded'})
+
+    if target['stats'] is None:
+        return jsonify({'error': 'No calls profiled yet'}), 404
+
+    if request.args.get('format') == 'text':
+        stream = io.StringIO()
+        stats = target['stats']
+        stats.stream = stream
+        stats.sort_stats('cumulative').print_stats(100)
+        stats.stream = sys.stdout
+        return Response(stream.getvalue(), mimetype='text/plain')
+
+    import tempfile
+    with tempfile.NamedTemporaryFile(suffix='.pstats') as tmp:
+        target['stats'].dump_stats(tmp.name)
+        data = tmp.read()
+    return Response(data, mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename={name}.pstats'})
+
 @socketio.on('connect')
 def handle_connect():
     """Gestisce la connessione WebSocket"""
@@ -924,8 +3156,84 @@ def handle_connect():
 def handle_disconnect():
     """Gestisce la disconnessione WebSocket"""
     print(f"Client disconnected: {session.get('username')}")
+    socket_encodings.pop(request.sid, None)
+
+    # I ttyd restano attivi (ricaricare la pagina li riusa): senza client
+    # vengono rilasciati dal reaper dopo HIBERNATE_AFTER secondi
+    for terminal_id in list(ttyd_instances):
+        release_terminal(terminal_id, request.sid)
+
+@socketio.on('negotiate_encoding')
+def handle_negotiate_encoding(data=None):
+    """
+    Il client indica le codifiche che supporta in ordine di preferenza
+    ('msgpack', 'compact'); il server sceglie la prima disponibile, altrimenti
+    JSON. La tabella degli host gia' inviati riparte da zero.
+    """
+    if 'username' not in session:
+        emit('error', {'message': 'Not authenticated'})
+        return
+
+    encoding = 'json'
+    for candidate in (data or {}).get('encodings') or []:
+        if candidate == 'compact' or (candidate == 'msgpack' and msgpack is not None):
+            encoding = candidate
+            break
+
+    socket_encodings[request.sid] = {'encoding': encoding, 'hosts': {}}
+    emit('encoding_selected', {'encoding': encoding})
+
+@socketio.on('list_sessions')
+@profiled('list_sessions')
+def handle_list_sessions(data=None):
+    """
+    Listing progressivo delle sessioni: invia subito quelle locali, poi un
+    'sessions_chunk' per ogni host remoto appena risponde, e infine
+    'sessions_complete'. Il client non aspetta piu' l'host piu' lento.
+    Accetta gli stessi filtri di /api/sessions (group, hosts, lazy, expanded).
+    """
+    if 'username' not in session:
+        emit('error', {'message': 'Not authenticated'})
+        return
+
+    data = data or {}
+    request_id = data.get('request_id')
+    ctx = get_user_context(session.get('username'))
+    hosts, include_local = select_hosts(ctx, **parse_host_selection(data))
+
+    if include_local:
+        emit_encoded('sessions_chunk', sessions_chunk_payload(request_id, 'local', get_tmux_sessions(ctx)))
+
+    for host, remote_sessions in iter_remote_sessions(hosts, ctx):
+        emit_encoded('sessions_chunk', sessions_chunk_payload(request_id, host['id'], remote_sessions))
+
+    emit_encoded('sessions_complete', {
+        'request_id': request_id,
+        'host_ids': (['local'] if include_local else []) + [h['id'] for h in hosts],
+        'groups': get_host_groups(ctx.enabled_hosts)
+    })
+
+def emit_terminal_ready(terminal_id, port, reused):
+    """Invia al client i dati per collegarsi al terminale"""
+    instance = ttyd_instances.get(terminal_id, {})
+    hold_terminal(terminal_id, request.sid)
+    payload = {
+        'terminal_id': terminal_id,
+        'session_name': instance.get('session_name'),
+        'host_id': instance.get('host_id', 'local'),
+        'reused': reused,
+        'ready_ms': instance.get('ready_ms'),
+        'hibernate_after': HIBERNATE_AFTER
+    }
+    if USE_NGINX_PROXY:
+        payload['use_nginx_proxy'] = True
+    else:
+        payload['port'] = port
+        payload['host'] = request.host.split(':')[0]
+    emit_encoded('terminal_ready', payload)
 
 @socketio.on('attach_session')
+@profiled('attach_session')
 def handle_attach_session(data):
     """Avvia ttyd per una sessione tmux o riusa uno esistente"""
     if 'username' not in session:
@@ -945,60 +3253,44 @@ def handle_attach_session(data):
         import sys
 
         # Check se esiste già un ttyd per questa sessione, host e utente
-        for tid, instance in ttyd_instances.items():
-            if (instance['session_name'] == session_name and
-                instance['username'] == username and
-                instance.get('host_id', 'local') == host_id):
-                # Riusa l'istanza esistente
-                port = instance['port']
-
-                sys.stderr.write(f"[ATTACH] Reusing existing ttyd for session {session_name} on {host_id}, terminal_id={tid}, port={port}\n")
-                sys.stderr.flush()
+        # (se uno spawn e' ancora in corso lo si attende invece di riusarlo a meta')
+        tid, port = None, None
+        if (username, host_id, session_name) not in ttyd_spawns_inflight:
+            tid, port = find_ttyd_instance(username, host_id, session_name)
+        if tid is not None:
+            # Riusa l'istanza esistente
+            metrics['ttyd_reused'] += 1
+
+            sys.stderr.write(f"[ATTACH] Reusing existing ttyd for session {session_name} on {host_id}, terminal_id={tid}, port={port}\n")
+            sys.stderr.flush()
 
-                # Verifica/ricrea configurazione nginx se necessario
-                if USE_NGINX_PROXY:
-                    create_nginx_terminal_config(tid, port)
+            # Verifica/ricrea configurazione nginx se necessario
+            if USE_NGINX_PROXY:
+                create_nginx_terminal_config(tid, port)
 
-                if USE_NGINX_PROXY:
-                    emit('terminal_ready', {
-                        'terminal_id': tid,
-                        'use_nginx_proxy': True,
-                        'reused': True
-                    })
-                else:
-                    host = request.host.split(':')[0]
-                    emit('terminal_ready', {
-                        'terminal_id': tid,
-                        'port': port,
-                        'host': host,
-                        'reused': True
-                    })
-                return
-
-        # Non esiste, avvia nuovo ttyd
-        terminal_id, port = start_ttyd(session_name, username, host_id)
+            emit_terminal_ready(tid, port, True)
+            return
+
+        # Non esiste, avvia nuovo ttyd (o attendi quello gia' in avvio)
+        terminal_id, port, coalesced = spawn_ttyd_single_flight(session_name, get_user_context(username), host_id)
 
         if terminal_id is None:
             emit('error', {'message': 'Failed to start terminal'})
             return
 
-        sys.stderr.write(f"[ATTACH] Started new ttyd for session {session_name}, terminal_id={terminal_id}, port={port}\n")
+        if coalesced:
+            sys.stderr.write(f"[ATTACH] Joined in-flight ttyd spawn for session {session_name}, terminal_id={terminal_id}, port={port}\n")
+        else:
+            sys.stderr.write(f"[ATTACH] Started new ttyd for session {session_name}, terminal_id={terminal_id}, port={port}\n")
         sys.stderr.flush()
 
-        if USE_NGINX_PROXY:
-            emit('terminal_ready', {
-                'terminal_id': terminal_id,
-                'use_nginx_proxy': True,
-                'reused': False
-            })
-        else:
-            host = request.host.split(':')[0]
-            emit('terminal_ready', {
-                'terminal_id': terminal_id,
-                'port': port,
-                'host': host,
-                'reused': False
-            })
+        emit_terminal_ready(terminal_id, port, coalesced)
+
+    except AdmissionError as e:
+        import sys
+        sys.stderr.write(f"[ATTACH] Rejected session {session_name} for {session.get('username')}: {e}\n")
+        sys.stderr.flush()
+        emit('error', {'message': str(e)})
 
     except Exception as e:
         import sys
@@ -1006,10 +3298,74 @@ def handle_attach_session(data):
         sys.stderr.flush()
         emit('error', {'message': f'Failed to attach session: {str(e)}'})
 
+@socketio.on('claim_terminals')
+def handle_claim_terminals(data):
+    """
+    Dopo una riconnessione il client ha un nuovo sid: dichiara i terminali che
+    sta ancora mostrando, cosi' il reaper non li considera senza client.
+    Risponde con quelli che nel frattempo non esistono piu'.
+    """
+    if 'username' not in session:
+        emit('error', {'message': 'Not authenticated'})
+        return
+
+    username = session.get('username')
+    missing = []
+    for terminal_id in (data or {}).get('terminal_ids') or []:
+        instance = ttyd_instances.get(terminal_id)
+        if instance is None or instance['username'] != username or instance['process'].poll() is not None:
+            missing.append(terminal_id)
+        else:
+            hold_terminal(terminal_id, request.sid)
+
+    emit('terminals_claimed', {'missing': missing})
+
+@socketio.on('hibernate_terminal')
+def handle_hibernate_terminal(data):
+    """
+    Il client ha chiuso l'iframe di un tab inattivo: se nessun altro client lo
+    usa, ttyd viene fermato. Risponde con l'ultima schermata della sessione da
+    mostrare al posto del terminale finche' il tab non viene riaperto.
+    """
+    if 'username' not in session:
+        emit('error', {'message': 'Not authenticated'})
+        return
+
+    username = session.get('username')
+    terminal_id = data.get('terminal_id')
+    session_name = data.get('session_name')
+    host_id = data.get('host_id', 'local')
+
+    instance = ttyd_instances.get(terminal_id)
+    if instance is not None and instance['username'] == username:
+        session_name = instance['session_name']
+        host_id = instance.get('host_id', 'local')
+        if release_terminal(terminal_id, request.sid):
+            metrics['ttyd_hibernated'] += 1
+            stop_ttyd(terminal_id)
+
+    if not session_name:
+        return
+
+    entry = get_host_previews(get_user_context(username), host_id)
+    preview = entry['sessions'].get(session_name) if entry else None
+    emit('terminal_hibernated', {
+        'terminal_id': terminal_id,
+        'session_name': session_name,
+        'host_id': host_id,
+        'version': preview['version'] if preview else None,
+        'lines': preview['versions'][preview['version']] if preview else []
+    })
+
 if __name__ == '__main__':
     if os.geteuid() != 0:
         print("Warning: This application should be run as root to authenticate system users")
 
+    build_assets()
+    socketio.start_background_task(search_indexer_loop)
+    if HIBERNATE_AFTER > 0:
+        socketio.start_background_task(hibernation_reaper_loop)
+
     # Initialize nginx terminals directory in remote mode
     if USE_NGINX_PROXY:
         os.makedirs(NGINX_TERMINALS_DIR, exist_ok=True)
@@ -10,7 +10,7 @@ let lastActiveSessionByHost = {}; // Track last active session per host: {hostId
 let zoomLevel = 1.0; // 100% = 1.0
 let currentTheme = 'dark'; // default theme
 
-// Mappa delle sessioni attive: "host_id:session_name" -> {terminal_id, iframe}
+// Mappa delle sessioni attive: "host_id:session_name" -> {terminal_id, iframe, lastShown, hibernated}
 let activeTerminals = {};
 
 // Context menu state
@@ -164,20 +164,36 @@ function updateThemeIcon(theme) {
 function setupSocketListeners() {
     socket.on('connect', () => {
         console.log('Connected to server');
+        socketUnavailable = false;
+        negotiateEncoding();
+        claimTerminals();
     });
 
+    socket.on('connect_error', handleSocketConnectError);
+    socket.on('encoding_selected', handleEncodingSelected);
+    socket.on('sessions_chunk', handleSessionsChunk);
+    socket.on('sessions_complete', handleSessionsComplete);
+
     socket.on('disconnect', () => {
         console.log('Disconnected from server');
+
+        // Non lasciare in sospeso chi attende il listing
+        resolvePendingSessionRequests();
     });
 
     socket.on('terminal_ready', (data) => {
+        data = decodePayload(data);
         console.log('Terminal ready:', data);
 
-        const sessionName = currentSessionName;
-        const hostId = currentHostId || 'local';
+        const sessionName = data.session_name || currentSessionName;
+        const hostId = data.host_id || currentHostId || 'local';
         const sessionKey = `${hostId}:${sessionName}`;
         const terminal_id = data.terminal_id;
 
+        if (data.hibernate_after !== undefined) {
+            hibernateAfter = data.hibernate_after;
+        }
+
         // Determine terminal URL based on deployment mode
         let terminalUrl;
         if (data.use_nginx_proxy) {
@@ -197,12 +213,13 @@ function setupSocketListeners() {
             // Ttyd già esistente
             console.log(`Reusing ttyd for ${sessionKey}`);
 
-            // Se non abbiamo ancora l'iframe, crealo
-            if (!activeTerminals[sessionKey]) {
+            // Se non abbiamo ancora l'iframe (o il tab era ibernato), crealo
+            if (!activeTerminals[sessionKey] || !activeTerminals[sessionKey].iframe) {
                 const iframe = createIframeElement(terminalUrl, sessionKey);
                 activeTerminals[sessionKey] = {
                     terminal_id: terminal_id,
-                    iframe: iframe
+                    iframe: iframe,
+                    lastShown: Date.now()
                 };
             }
         } else {
@@ -212,17 +229,24 @@ function setupSocketListeners() {
             const iframe = createIframeElement(terminalUrl, sessionKey);
             activeTerminals[sessionKey] = {
                 terminal_id: terminal_id,
-                iframe: iframe
+                iframe: iframe,
+                lastShown: Date.now()
             };
         }
 
-        // Mostra questo terminale e nascondi gli altri
-        showTerminal(sessionKey);
+        // Mostra questo terminale e nascondi gli altri (se nel frattempo
+        // l'utente non e' passato ad un altro tab)
+        if (sessionName === currentSessionName && hostId === (currentHostId || 'local')) {
+            showTerminal(sessionKey);
+        }
 
         // Mantieni il tab evidenziato
         updateActiveTab();
     });
 
+    socket.on('terminal_hibernated', handleTerminalHibernated);
+    socket.on('terminals_claimed', handleTerminalsClaimed);
+
     socket.on('terminal_closed', (data) => {
         console.log('Terminal closed:', data.terminal_id);
         // Non facciamo nulla - teniamo ttyd alive
@@ -271,46 +295,173 @@ function createIframeElement(terminalUrl, sessionKey) {
 }
 
 function showTerminal(sessionKey) {
-    // Nascondi tutti gli iframe
+    // Nascondi tutti gli iframe e l'eventuale schermata di un tab ibernato
     Object.values(activeTerminals).forEach(term => {
         if (term.iframe) {
             term.iframe.style.display = 'none';
         }
     });
+    hideSnapshot();
 
     // Mostra quello richiesto
     if (activeTerminals[sessionKey] && activeTerminals[sessionKey].iframe) {
         activeTerminals[sessionKey].iframe.style.display = 'block';
+        activeTerminals[sessionKey].lastShown = Date.now();
         console.log(`Showing terminal for ${sessionKey}`);
     }
 }
 
-async function loadSessions() {
+// Gruppi di host: in modalita' lazy vengono interrogati solo gli host
+// non raggruppati e quelli dei gruppi espansi nella sidebar
+let expandedGroups = new Set(JSON.parse(localStorage.getItem('workbench-expanded-groups') || '[]'));
+let hostGroups = {}; // group -> [host_id]
+
+// Listing progressivo via Socket.IO: richieste in corso request_id -> {resolve, full, params}
+let sessionsRequestId = 0;
+let pendingSessionRequests = {};
+let socketUnavailable = false; // true se il websocket non riesce a connettersi
+
+function loadSessions(group) {
+    // Senza group: listing completo (lazy); con group: solo gli host del gruppo
+    const params = group ? { group: group } : { lazy: true, expanded: [...expandedGroups] };
+
+    // Se il websocket non riesce a connettersi si usa l'API HTTP classica;
+    // durante la prima connessione socket.io mette in coda l'emit
+    if (socketUnavailable) {
+        return fetchSessions(params);
+    }
+
+    // Un listing completo supera quelli ancora in corso
+    if (!group) {
+        resolvePendingSessionRequests();
+    }
+
+    const requestId = ++sessionsRequestId;
+    return new Promise(resolve => {
+        pendingSessionRequests[requestId] = { resolve: resolve, full: !group, params: params };
+        socket.emit('list_sessions', Object.assign({ request_id: requestId }, params));
+    });
+}
+
+function handleSocketConnectError() {
+    console.log('Socket connection failed, using HTTP for session listing');
+    socketUnavailable = true;
+
+    // Le richieste in attesa della connessione passano all'API HTTP
+    const pending = Object.values(pendingSessionRequests);
+    pendingSessionRequests = {};
+    pending.forEach(request => {
+        fetchSessions(request.params).then(request.resolve);
+    });
+}
+
+function resolvePendingSessionRequests() {
+    Object.values(pendingSessionRequests).forEach(request => request.resolve());
+    pendingSessionRequests = {};
+}
+
+function handleSessionsChunk(data) {
+    data = decodePayload(data);
+
+    // La tabella degli host va aggiornata anche per le richieste superate:
+    // le voci vengono inviate una sola volta per connessione
+    const chunkSessions = data.rows ? expandSessionRows(data, socketHostTable) : data.sessions;
+
+    if (!pendingSessionRequests[data.request_id]) {
+        return; // Risposta di una richiesta superata
+    }
+
+    // Sostituisci le sessioni di questo host, mantieni le altre
+    sessions = sessions.filter(s => s.host_id !== data.host_id).concat(chunkSessions);
+    renderSessionsView();
+}
+
+function handleSessionsComplete(data) {
+    data = decodePayload(data);
+    const request = pendingSessionRequests[data.request_id];
+    if (!request) {
+        return;
+    }
+    delete pendingSessionRequests[data.request_id];
+
+    applySessionsScope(data.host_ids, data.groups, request.full);
+    request.resolve();
+}
+
+function applySessionsScope(hostIds, groups, full) {
+    hostGroups = groups || {};
+
+    // Dopo un listing completo restano solo gli host interrogati
+    // (rimuove host eliminati, disabilitati o in gruppi chiusi)
+    if (full) {
+        const queried = new Set(hostIds);
+        sessions = sessions.filter(s => queried.has(s.host_id));
+    }
+    renderSessionsView();
+}
+
+function renderSessionsView() {
+    renderHostsTabs();
+    renderTabs();
+
+    // Mantieni il tab attivo evidenziato
+    updateActiveTab();
+}
+
+async function fetchSessions(params) {
     try {
-        const response = await fetch('/api/sessions');
-        const data = await response.json();
+        const query = new URLSearchParams();
+        Object.entries(params || {}).forEach(([key, value]) => {
+            query.set(key, Array.isArray(value) ? value.join(',') : value);
+        });
+
+        query.set('compact', '1');
+
+        const response = await fetch(`/api/sessions?${query}`, {
+            headers: { 'Accept': window.MessagePack ? 'application/x-msgpack, application/json;q=0.5' : 'application/json' }
+        });
+        const data = response.headers.get('Content-Type') === 'application/x-msgpack'
+            ? MessagePack.decode(new Uint8Array(await response.arrayBuffer()))
+            : await response.json();
 
         if (data.error) {
             console.error('Error loading sessions:', data.error);
             return;
         }
 
-        sessions = data.sessions;
-        renderHostsTabs();
-        renderTabs();
-
-        // Mantieni il tab attivo evidenziato
-        updateActiveTab();
+        const fetched = new Set(data.host_ids);
+        const fetchedSessions = data.rows ? expandSessionRows(data, []) : data.sessions;
+        sessions = sessions.filter(s => !fetched.has(s.host_id)).concat(fetchedSessions);
+        applySessionsScope(data.host_ids, data.groups, !params.group);
     } catch (error) {
         console.error('Error fetching sessions:', error);
         showError('Impossibile caricare le sessioni');
     }
 }
 
+function toggleGroup(group) {
+    if (expandedGroups.has(group)) {
+        expandedGroups.delete(group);
+
+        // Nascondi le sessioni degli host che non sono in altri gruppi espansi
+        const stillVisible = new Set();
+        expandedGroups.forEach(g => (hostGroups[g] || []).forEach(id => stillVisible.add(id)));
+        const collapsed = new Set((hostGroups[group] || []).filter(id => !stillVisible.has(id)));
+        sessions = sessions.filter(s => !collapsed.has(s.host_id));
+        renderSessionsView();
+    } else {
+        expandedGroups.add(group);
+        // Gli host del gruppo vengono interrogati solo ora
+        loadSessions(group);
+    }
+
+    localStorage.setItem('workbench-expanded-groups', JSON.stringify([...expandedGroups]));
+}
+
 function renderHostsTabs() {
     const hostsTabsList = document.getElementById('hosts-tabs-list');
 
-    if (sessions.length === 0) {
+    if (sessions.length === 0 && Object.keys(hostGroups).length === 0) {
         hostsTabsList.innerHTML = '';
         return;
     }
@@ -350,6 +501,20 @@ function renderHostsTabs() {
         `;
     });
 
+    // Gruppi di host: click per espandere (e interrogare) o chiudere
+    Object.keys(hostGroups).sort().forEach(group => {
+        const expanded = expandedGroups.has(group);
+
+        html += `
+            <div class="host-tab host-group-tab ${expanded ? 'expanded' : ''}"
+                 title="${expanded ? 'Chiudi' : 'Espandi'} gruppo ${group}"
+                 onclick="toggleGroup('${group}')">
+                <span class="host-tab-name">${expanded ? '▾' : '▸'} ${group}</span>
+                <span class="host-tab-count">${hostGroups[group].length}</span>
+            </div>
+        `;
+    });
+
     hostsTabsList.innerHTML = html;
 }
 
@@ -420,6 +585,8 @@ function renderTabs() {
                      style="background: linear-gradient(135deg, ${hostColor}15 0%, ${hostColor}08 100%); border-left: 3px solid ${hostColor};"
                      title="${tooltipText}"
                      onclick="attachSession('${session.name}', '${session.host_id}')"
+                     onmouseenter="schedulePreview(event, '${session.name}', '${session.host_id}')"
+                     onmouseleave="hidePreview()"
                      oncontextmenu="showContextMenu(event, '${session.name}', '${session.host_id}')">
                     <div class="tab-name">${session.name}</div>
                 </div>
@@ -463,10 +630,19 @@ function attachSession(sessionName, hostId) {
     const sessionKey = `${hostId}:${sessionName}`;
 
     // Check se abbiamo già un iframe per questa sessione
-    if (activeTerminals[sessionKey]) {
+    if (activeTerminals[sessionKey] && activeTerminals[sessionKey].iframe) {
         console.log(`Terminal already exists for ${sessionKey}, showing it`);
         // Switch istantaneo: mostra questo, nascondi gli altri
         showTerminal(sessionKey);
+    } else if (activeTerminals[sessionKey] && activeTerminals[sessionKey].hibernated) {
+        console.log(`Resuming hibernated terminal for ${sessionKey}`);
+        // Mostra subito l'ultima schermata, poi riattacca come la prima volta
+        showTerminal(null);
+        showSnapshot(sessionKey);
+        socket.emit('attach_session', {
+            session_name: sessionName,
+            host_id: hostId
+        });
     } else {
         console.log(`Terminal doesn't exist for ${sessionKey}, requesting from server`);
         // Prima volta: richiedi ttyd al server
@@ -565,6 +741,7 @@ function renderHostsList() {
                         </svg>
                         ${host.username || 'current user'}
                     </div>
+                    ${(host.groups || []).length ? `<div class="host-detail">Gruppi: ${host.groups.join(', ')}</div>` : ''}
                     <div class="host-detail">
                         ${host.enabled ?
                             '<span style="color: #4ade80;">● Abilitato</span>' :
@@ -623,6 +800,7 @@ async function editHost(hostId) {
     document.getElementById('host-hostname').value = host.hostname;
     document.getElementById('host-port').value = host.port;
     document.getElementById('host-username').value = host.username || '';
+    document.getElementById('host-groups').value = (host.groups || []).join(', ');
     document.getElementById('host-enabled').checked = host.enabled;
 
     formContainer.style.display = 'block';
@@ -665,6 +843,7 @@ async function handleHostFormSubmit(e) {
         hostname: document.getElementById('host-hostname').value,
         port: parseInt(document.getElementById('host-port').value),
         username: document.getElementById('host-username').value || null,
+        groups: document.getElementById('host-groups').value.split(',').map(g => g.trim()).filter(g => g),
         enabled: document.getElementById('host-enabled').checked
     };
 
@@ -920,3 +1099,250 @@ async function deleteSession(sessionName, hostId) {
         alert('Errore durante l\'eliminazione della sessione');
     }
 }
+
+// ========================================
+// Session Preview on Hover
+// ========================================
+
+// Copie locali delle anteprime: "host_id:session_name" -> {version, lines}
+let previewCache = {};
+let previewTimer = null;
+let previewKey = null;
+
+function schedulePreview(e, sessionName, hostId) {
+    hidePreview();
+    const rect = e.currentTarget.getBoundingClientRect();
+    previewKey = `${hostId}:${sessionName}`;
+
+    // Piccolo ritardo: passare sopra i tab velocemente non genera richieste
+    previewTimer = setTimeout(() => {
+        loadPreview(sessionName, hostId, rect);
+    }, 300);
+}
+
+function hidePreview() {
+    clearTimeout(previewTimer);
+    previewTimer = null;
+    previewKey = null;
+    const popup = document.getElementById('session-preview');
+    if (popup) {
+        popup.style.display = 'none';
+    }
+}
+
+async function loadPreview(sessionName, hostId, rect) {
+    const sessionKey = `${hostId}:${sessionName}`;
+    const cached = previewCache[sessionKey];
+
+    const params = new URLSearchParams({ session_name: sessionName, host_id: hostId });
+    if (cached) {
+        params.set('version', cached.version);
+    }
+
+    try {
+        const response = await fetch(`/api/preview?${params}`);
+        if (!response.ok) {
+            return;
+        }
+        const data = await response.json();
+
+        // Applica la risposta: completa, diff o invariata
+        let lines;
+        if (data.lines) {
+            lines = data.lines;
+        } else if (data.diff && cached) {
+            lines = cached.lines.slice(0, data.diff.length);
+            data.diff.changes.forEach(([index, text]) => {
+                lines[index] = text;
+            });
+        } else if (data.unchanged && cached) {
+            lines = cached.lines;
+        } else {
+            return;
+        }
+        previewCache[sessionKey] = { version: data.version, lines: lines };
+
+        if (previewKey === sessionKey) {
+            showPreview(lines, rect);
+        }
+    } catch (error) {
+        console.error('Error loading preview:', error);
+    }
+}
+
+function showPreview(lines, rect) {
+    const popup = document.getElementById('session-preview');
+    if (!popup) {
+        return;
+    }
+
+    popup.textContent = lines.join('\n');
+    popup.style.left = `${rect.left}px`;
+    popup.style.top = `${rect.bottom + 6}px`;
+    popup.style.display = 'block';
+}
+
+// ========================================
+// Hibernation of Inactive Tabs
+// ========================================
+
+// Secondi dopo cui un tab non mostrato viene ibernato (dal server, 0 = mai)
+let hibernateAfter = 0;
+
+setInterval(hibernateIdleTerminals, 30000);
+
+function hibernateIdleTerminals() {
+    if (!hibernateAfter) {
+        return;
+    }
+
+    const currentKey = `${currentHostId || 'local'}:${currentSessionName}`;
+    const now = Date.now();
+
+    Object.keys(activeTerminals).forEach(sessionKey => {
+        const term = activeTerminals[sessionKey];
+        if (!term.iframe) {
+            return;
+        }
+        if (sessionKey === currentKey) {
+            term.lastShown = now;
+        } else if (now - term.lastShown > hibernateAfter * 1000) {
+            hibernateTerminal(sessionKey);
+        }
+    });
+}
+
+function hibernateTerminal(sessionKey) {
+    const term = activeTerminals[sessionKey];
+    console.log(`Hibernating terminal for ${sessionKey}`);
+
+    // Chiudere l'iframe chiude websocket e xterm; il server rilascia ttyd
+    term.iframe.remove();
+    term.iframe = null;
+    term.hibernated = true;
+
+    const separator = sessionKey.indexOf(':');
+    socket.emit('hibernate_terminal', {
+        terminal_id: term.terminal_id,
+        host_id: sessionKey.slice(0, separator),
+        session_name: sessionKey.slice(separator + 1)
+    });
+}
+
+function claimTerminals() {
+    // Con la riconnessione il server vede un nuovo client: gli si dichiarano
+    // i terminali ancora aperti, altrimenti verrebbero rilasciati come inattivi
+    const terminalIds = Object.values(activeTerminals)
+        .filter(term => term.iframe)
+        .map(term => term.terminal_id);
+    if (terminalIds.length > 0) {
+        socket.emit('claim_terminals', { terminal_ids: terminalIds });
+    }
+}
+
+function handleTerminalsClaimed(data) {
+    const missing = new Set(data.missing);
+    const currentKey = `${currentHostId || 'local'}:${currentSessionName}`;
+
+    Object.keys(activeTerminals).forEach(sessionKey => {
+        const term = activeTerminals[sessionKey];
+        if (!term.iframe || !missing.has(term.terminal_id)) {
+            return;
+        }
+
+        // ttyd non esiste piu' (es. rilasciato durante la disconnessione):
+        // il tab diventa ibernato e si riprende dal percorso di attach
+        console.log(`Terminal for ${sessionKey} is gone, marking it hibernated`);
+        term.iframe.remove();
+        term.iframe = null;
+        term.hibernated = true;
+
+        if (sessionKey === currentKey) {
+            attachSession(currentSessionName, currentHostId || 'local');
+        }
+    });
+}
+
+function handleTerminalHibernated(data) {
+    const sessionKey = `${data.host_id}:${data.session_name}`;
+    if (data.version) {
+        previewCache[sessionKey] = { version: data.version, lines: data.lines };
+    }
+
+    // Il tab potrebbe essere stato riaperto mentre il server rispondeva
+    const snapshot = document.getElementById('terminal-snapshot');
+    if (snapshot && snapshot.dataset.sessionKey === sessionKey) {
+        showSnapshot(sessionKey);
+    }
+}
+
+function showSnapshot(sessionKey) {
+    const container = document.getElementById('terminal-container');
+    let snapshot = document.getElementById('terminal-snapshot');
+    if (!snapshot) {
+        snapshot = document.createElement('pre');
+        snapshot.id = 'terminal-snapshot';
+        snapshot.className = 'terminal-snapshot';
+        container.appendChild(snapshot);
+    }
+
+    const emptyState = container.querySelector('.empty-state');
+    if (emptyState) {
+        emptyState.style.display = 'none';
+    }
+
+    const cached = previewCache[sessionKey];
+    snapshot.dataset.sessionKey = sessionKey;
+    snapshot.textContent = cached ? cached.lines.join('\n') : '';
+    snapshot.style.display = 'block';
+}
+
+function hideSnapshot() {
+    const snapshot = document.getElementById('terminal-snapshot');
+    if (snapshot) {
+        snapshot.style.display = 'none';
+        delete snapshot.dataset.sessionKey;
+    }
+}
+
+// ========================================
+// Compact Encoding (host table + MessagePack)
+// ========================================
+
+// Codifica negoziata per gli eventi Socket.IO e tabella degli host ricevuti
+// su questa connessione: indice -> {host_id, host_name, host_color}
+let socketEncoding = 'json';
+let socketHostTable = [];
+
+function negotiateEncoding() {
+    // MessagePack solo se la libreria e' stata caricata, altrimenti JSON compatto
+    const encodings = window.MessagePack ? ['msgpack', 'compact'] : ['compact'];
+    socket.emit('negotiate_encoding', { encodings: encodings });
+}
+
+function handleEncodingSelected(data) {
+    socketEncoding = data.encoding;
+    socketHostTable = [];
+    console.log(`Using ${socketEncoding} encoding for Socket.IO events`);
+}
+
+function decodePayload(data) {
+    if (data instanceof ArrayBuffer) {
+        return MessagePack.decode(new Uint8Array(data));
+    }
+    return data;
+}
+
+function expandSessionRows(data, hostTable) {
+    (data.hosts || []).forEach(([index, hostId, hostName, hostColor]) => {
+        hostTable[index] = { host_id: hostId, host_name: hostName, host_color: hostColor };
+    });
+
+    return data.rows.map(([hostIndex, id, name, created, windows, attached]) => Object.assign({
+        id: id,
+        name: name,
+        created: created,
+        windows: windows,
+        attached: attached
+    }, hostTable[hostIndex]));
+}